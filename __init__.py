@@ -3,33 +3,105 @@ import logging
 import json
 import asyncio
 
+import voluptuous as vol
+
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant, callback
+from homeassistant.core import HomeAssistant
 from homeassistant.const import CONF_HOST, CONF_PORT, CONF_SWITCHES
+import homeassistant.helpers.config_validation as cv
 
-from .denon_tcp_client import DenonTcpClient
+from .command_scheduler import DEFAULT_COMMAND_INTERVAL, DEFAULT_QUEUE_SIZE, DEFAULT_QUEUE_TTL
+from .optimistic_state import DEFAULT_OPTIMISTIC_TIMEOUT
+from .denon_tcp_client import DenonTcpClient, DEFAULT_IDLE_TIMEOUT, DEFAULT_PROBE_TIMEOUT, DEFAULT_REFRESH_MAX_AGE, DEFAULT_QUERY_TIMEOUT
+from .status_poller import DEFAULT_POLL_INTERVAL, DEFAULT_POLL_MIN_INTERVAL, DEFAULT_POLL_MAX_INTERVAL
+from .telnet_proxy import DEFAULT_PROXY_HOST
 
 DOMAIN = 'denon_avr_net'
 
 ATTR_HOST = 'host'
 ATTR_COMMAND = 'command'
+ATTR_FORCE = 'force'
+ATTR_WAIT = 'wait'
+ATTR_EXPECT = 'expect'
+ATTR_TIMEOUT = 'timeout'
 DEFAULT_HOST = 'none'
 DEFAULT_COMMAND = 'SI?'
 
+CONF_COMMAND_INTERVAL = 'command_interval'
+CONF_QUEUE_SIZE = 'queue_size'
+CONF_QUEUE_TTL = 'queue_ttl'
+CONF_IDLE_TIMEOUT = 'idle_timeout'
+CONF_PROBE_TIMEOUT = 'probe_timeout'
+CONF_KEEPALIVE = 'keepalive'
+CONF_CACHE = 'cache'
+CONF_REFRESH_KEYS = 'refresh_keys'
+CONF_REFRESH_MAX_AGE = 'refresh_max_age'
+CONF_POLL_INTERVAL = 'poll_interval'
+CONF_POLL_MIN_INTERVAL = 'poll_min_interval'
+CONF_POLL_MAX_INTERVAL = 'poll_max_interval'
+CONF_CAPTURE = 'capture'
+CONF_METRICS = 'metrics'
+CONF_OPTIMISTIC_TIMEOUT = 'optimistic_timeout'
+CONF_SUPPRESS = 'suppress_redundant'
+CONF_PROXY_PORT = 'proxy_port'
+CONF_PROXY_HOST = 'proxy_host'
+
 _LOGGER = logging.getLogger(__name__)
 
+STEP_SCHEMA = vol.Any(
+    cv.string,
+    vol.Schema(
+        {
+            vol.Required(ATTR_COMMAND): cv.string,
+            vol.Optional(ATTR_WAIT, default=0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+            vol.Optional(ATTR_EXPECT, default=False): vol.Any(bool, cv.string),
+        }
+    ),
+)
+
+RAW_COMMAND_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_HOST, default=DEFAULT_HOST): cv.string,
+        vol.Optional(ATTR_COMMAND, default=DEFAULT_COMMAND): vol.Any([STEP_SCHEMA], cv.string),
+        vol.Optional(ATTR_FORCE, default=False): cv.boolean,
+        vol.Optional(ATTR_TIMEOUT, default=DEFAULT_QUERY_TIMEOUT): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    }
+)
+
+def sequence_steps(commands):
+    """Return the (command, wait, expect) steps of a validated list of commands.
+
+    Each item is a command string or a mapping with command, wait (seconds)
+    and expect (frame prefix, or true for the command's own echo).
+    """
+    steps = []
+    for step in commands:
+        if isinstance(step, dict):
+            command = step[ATTR_COMMAND]
+            expect = step[ATTR_EXPECT]
+            if expect is True:
+                # Queries are answered without the question mark, like query()
+                expect = command.rstrip('? ')
+            steps.append((command, step[ATTR_WAIT], expect or None))
+        else:
+            steps.append((step, 0, None))
+    return steps
+
 async def async_setup(hass, config):
 
-    @callback
-    def handle_raw_command(call):
-        host = call.data.get(ATTR_HOST, DEFAULT_HOST)
+    async def handle_raw_command(call):
+        host = call.data[ATTR_HOST]
 
         if host != DEFAULT_HOST:
-            command = call.data.get(ATTR_COMMAND, DEFAULT_COMMAND)
+            command = call.data[ATTR_COMMAND]
             client = hass.data[DOMAIN][host]['client']
-            client.send('{0}\r'.format(command).encode('utf-8'))
+            force = call.data[ATTR_FORCE]
+            if isinstance(command, list):
+                await client.run_sequence(sequence_steps(command), force=force, timeout=call.data[ATTR_TIMEOUT])
+            else:
+                client.send_command(command, force=force)
 
-    hass.services.async_register(DOMAIN, "raw_command", handle_raw_command)
+    hass.services.async_register(DOMAIN, "raw_command", handle_raw_command, schema=RAW_COMMAND_SCHEMA)
     
     hass.data.setdefault(DOMAIN, {})
 
@@ -42,10 +114,31 @@ async def async_setup(hass, config):
                 else:
                     port = 23
                 _LOGGER.info('Setting up %s on host: %s:', DOMAIN, host)
-                client = DenonTcpClient(host, port)
+                client = DenonTcpClient(
+                    host,
+                    port,
+                    command_interval=entry.get(CONF_COMMAND_INTERVAL, DEFAULT_COMMAND_INTERVAL),
+                    queue_size=entry.get(CONF_QUEUE_SIZE, DEFAULT_QUEUE_SIZE),
+                    queue_ttl=entry.get(CONF_QUEUE_TTL, DEFAULT_QUEUE_TTL),
+                    idle_timeout=entry.get(CONF_IDLE_TIMEOUT, DEFAULT_IDLE_TIMEOUT),
+                    probe_timeout=entry.get(CONF_PROBE_TIMEOUT, DEFAULT_PROBE_TIMEOUT),
+                    keepalive=entry.get(CONF_KEEPALIVE, False),
+                    cache=entry.get(CONF_CACHE, True),
+                    refresh_keys=entry.get(CONF_REFRESH_KEYS),
+                    refresh_max_age=entry.get(CONF_REFRESH_MAX_AGE, DEFAULT_REFRESH_MAX_AGE),
+                    poll_interval=entry.get(CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL),
+                    poll_min_interval=entry.get(CONF_POLL_MIN_INTERVAL, DEFAULT_POLL_MIN_INTERVAL),
+                    poll_max_interval=entry.get(CONF_POLL_MAX_INTERVAL, DEFAULT_POLL_MAX_INTERVAL),
+                    capture=entry.get(CONF_CAPTURE),
+                    metrics=entry.get(CONF_METRICS, True),
+                    suppress=entry.get(CONF_SUPPRESS, True),
+                    proxy_port=entry.get(CONF_PROXY_PORT),
+                    proxy_host=entry.get(CONF_PROXY_HOST, DEFAULT_PROXY_HOST),
+                )
                 
                 hass.data[DOMAIN][host] = {
-                    'client': client
+                    'client': client,
+                    'optimistic_timeout': entry.get(CONF_OPTIMISTIC_TIMEOUT, DEFAULT_OPTIMISTIC_TIMEOUT),
                 }
                 await client.async_added_to_hass(hass)
 
@@ -0,0 +1,93 @@
+"""Counters and histograms describing the work done by a Denon AVR client."""
+from bisect import bisect_left
+
+# Upper bounds in seconds, from 10 us to 100 ms
+TIME_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+TOP_LISTENERS = 10
+
+def listener_name(listener):
+    """Name a listener after its entity (bound methods) or its qualified name."""
+    owner = getattr(listener, '__self__', None)
+    function = getattr(listener, '__func__', listener)
+    name = getattr(function, '__qualname__', None) or type(listener).__name__
+    entity_name = getattr(owner, 'name', None)
+    if isinstance(entity_name, str):
+        return '{0} ({1})'.format(name, entity_name)
+    return name
+
+class Histogram:
+    """Fixed bucket histogram. Percentiles are reported as bucket upper bounds."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self, scale=1, digits=1):
+        """Return count, mean, p50, p95, p99 and max, multiplied by scale."""
+        mean = self.total / self.count if self.count else 0
+        return {
+            'count': self.count,
+            'mean': round(mean * scale, digits),
+            'p50': round(self.percentile(0.5) * scale, digits),
+            'p95': round(self.percentile(0.95) * scale, digits),
+            'p99': round(self.percentile(0.99) * scale, digits),
+            'max': round(self.max * scale, digits),
+        }
+
+class ClientMetrics:
+    """Traffic counters plus parse, listener and queue depth histograms."""
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.chunks_in = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        self.parse_time = Histogram(TIME_BUCKETS)
+        self.queue_depth = Histogram(DEPTH_BUCKETS)
+        self.listener_times = {}
+
+    def listener_time(self, listener, elapsed):
+        histogram = self.listener_times.get(listener)
+        if histogram is None:
+            histogram = self.listener_times[listener] = Histogram(TIME_BUCKETS)
+        histogram.add(elapsed)
+
+    def as_dict(self):
+        """Return the metrics as plain values. Times are in microseconds."""
+        listeners = sorted(self.listener_times.items(), key=lambda item: item[1].total, reverse=True)
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'chunks_in': self.chunks_in,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'parse_us': self.parse_time.summary(1e6),
+            'queue_depth': self.queue_depth.summary(digits=2),
+            'listener_us': {
+                listener_name(listener): histogram.summary(1e6)
+                for listener, histogram in listeners[:TOP_LISTENERS]
+            },
+        }
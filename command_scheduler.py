@@ -0,0 +1,174 @@
+"""Paced outbound command queue for a Denon AVR connection."""
+import logging
+import time
+from collections import OrderedDict, deque
+
+from .protocol import affected_states, coalesce_key
+
+_LOGGER = logging.getLogger(__name__)
+
+PRIORITY_USER = 0
+PRIORITY_STATUS = 1
+
+DEFAULT_COMMAND_INTERVAL = 0.05
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_QUEUE_TTL = 30
+
+class CommandScheduler:
+    """Write queued commands at most once per interval.
+
+    User commands are always sent before status queries. A newer command
+    with the same coalesce key as a queued one replaces it so only the latest
+    value of a setting reaches the receiver. It takes the queued command's
+    place unless a command queued after that one touches the same state
+    (MV50, MVUP, MV60), in which case it goes to the end of the queue so the
+    receiver still sees the commands in the order they were sent.
+    """
+
+    def __init__(self, write, interval=DEFAULT_COMMAND_INTERVAL):
+        self.loop = None
+        self.interval = interval
+        self.sent = 0
+        self.dropped = 0
+        self._write = write
+        self._lanes = (deque(), deque())
+        self._pending = {}
+        self._paused = True
+        self._last_write = None
+        self._timer = None
+
+    @property
+    def depth(self):
+        return len(self._lanes[PRIORITY_USER]) + len(self._lanes[PRIORITY_STATUS])
+
+    def push(self, data, priority=PRIORITY_USER):
+        key = coalesce_key(data)
+        if key is not None:
+            entry = self._pending.get(key)
+            if entry is not None:
+                _LOGGER.debug('Replacing queued command %r with %r', entry[0], data)
+                self.dropped += 1
+                lane = self._lanes[entry[2]]
+                if not self._touched_after(lane, entry):
+                    entry[0] = data
+                    return
+                lane.remove(entry)
+            entry = [data, key, priority]
+            self._pending[key] = entry
+        else:
+            entry = [data, None, priority]
+        self._lanes[priority].append(entry)
+        self._schedule()
+
+    def _touched_after(self, lane, entry):
+        """Return True if a command queued after entry may change a state entry changes."""
+        states = affected_states(entry[0])
+        for later in reversed(lane):
+            if later is entry:
+                return False
+            later_states = affected_states(later[0])
+            if states is None or later_states is None or states & later_states:
+                return True
+        return False
+
+    def pause(self):
+        self._paused = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def resume(self):
+        self._paused = False
+        self._schedule()
+
+    def clear(self):
+        for lane in self._lanes:
+            lane.clear()
+        self._pending.clear()
+
+    def drain(self):
+        """Remove and return the (data, priority) of every queued command in the order they would be written."""
+        commands = [(data, priority) for lane in self._lanes for data, _, priority in lane]
+        self.clear()
+        return commands
+
+    def _schedule(self):
+        if self._timer is not None or self._paused or not self.depth:
+            return
+        delay = 0
+        if self._last_write is not None:
+            delay = max(0, self._last_write + self.interval - self.loop.time())
+        self._timer = self.loop.call_later(delay, self._send_next)
+
+    def _send_next(self):
+        self._timer = None
+        if self._paused:
+            return
+        lane = self._lanes[PRIORITY_USER] or self._lanes[PRIORITY_STATUS]
+        if not lane:
+            return
+        data, key, _ = lane.popleft()
+        if key is not None:
+            del self._pending[key]
+        self._last_write = self.loop.time()
+        self.sent += 1
+        self._write(data)
+        self._schedule()
+
+class OfflineQueue:
+    """Bounded queue for commands sent while the receiver is not connected.
+
+    Commands expire after ttl seconds, a newer command replaces a queued
+    command with the same coalesce key (or identical bytes) and the oldest
+    command is dropped once max_size commands are queued. All operations are
+    O(1) apart from draining.
+    """
+
+    def __init__(self, max_size=DEFAULT_QUEUE_SIZE, ttl=DEFAULT_QUEUE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.dropped = 0
+        self._commands = OrderedDict()
+
+    def __len__(self):
+        return len(self._commands)
+
+    def push(self, data, priority=PRIORITY_USER):
+        key = coalesce_key(data) or data
+        if key in self._commands:
+            self._commands.move_to_end(key)
+            self.dropped += 1
+        elif len(self._commands) >= self.max_size:
+            _, (dropped, _, _) = self._commands.popitem(last=False)
+            _LOGGER.debug('Offline queue full. Dropping command: %r', dropped)
+            self.dropped += 1
+        self._commands[key] = (data, priority, time.monotonic() + self.ttl)
+
+    def prepend(self, commands):
+        """Queue (data, priority) commands ahead of the queued ones, e.g. those not written before a disconnect.
+
+        A queued command with the same coalesce key is newer and wins.
+        """
+        expires = time.monotonic() + self.ttl
+        for data, priority in reversed(commands):
+            key = coalesce_key(data) or data
+            if key in self._commands:
+                self.dropped += 1
+                continue
+            self._commands[key] = (data, priority, expires)
+            self._commands.move_to_end(key, last=False)
+        while len(self._commands) > self.max_size:
+            self._commands.popitem(last=False)
+            self.dropped += 1
+
+    def drain(self):
+        """Remove and return the (data, priority) of every command that has not expired."""
+        now = time.monotonic()
+        commands = []
+        for data, priority, expires in self._commands.values():
+            if expires > now:
+                commands.append((data, priority))
+            else:
+                self.dropped += 1
+        self._commands.clear()
+        return commands
@@ -1,211 +1,860 @@
 import asyncio
 import logging
+import random
+import socket
+from time import perf_counter
 
 from homeassistant.const import EVENT_HOMEASSISTANT_STOP
 from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from .command_scheduler import (
+    CommandScheduler,
+    OfflineQueue,
+    DEFAULT_COMMAND_INTERVAL,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_QUEUE_TTL,
+    PRIORITY_STATUS,
+    PRIORITY_USER,
+)
+from .client_metrics import ClientMetrics
+from .traffic_capture import TrafficCapture, DIRECTION_CONNECT, DIRECTION_IN, DIRECTION_OUT
+from .telnet_proxy import TelnetProxy, DEFAULT_PROXY_HOST
+from .status_poller import StatusPoller, DEFAULT_POLL_INTERVAL, DEFAULT_POLL_MIN_INTERVAL, DEFAULT_POLL_MAX_INTERVAL
+from .protocol import (
+    STATUS_QUERIES,
+    decode_frame,
+    decode_value,
+    decode_zone,
+    encode_command,
+    frames_overlap,
+    key_matches,
+    patterns_overlap,
+    predict_states,
+    query_stem,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+FRAME_TERMINATOR = b'\r'
+DEFAULT_MAX_FRAME_LENGTH = 256
+DEFAULT_QUERY_TIMEOUT = 2.0
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_RECONNECT_DELAY = 0.25
+DEFAULT_RECONNECT_MAX_DELAY = 30
+RECONNECT_JITTER = 0.2
+# A connection resets the backoff once it delivered a frame or stayed up this long
+STABLE_CONNECTION_TIME = 10
+DEFAULT_IDLE_TIMEOUT = 60
+DEFAULT_PROBE_TIMEOUT = 5
+PROBE_COMMAND = 'PW?'
+
+# TCP keepalive: start probing after 10 s idle, every 5 s, give up after 3 misses
+KEEPALIVE_OPTIONS = (
+    ('TCP_KEEPIDLE', 10),
+    ('TCP_KEEPALIVE', 10),
+    ('TCP_KEEPINTVL', 5),
+    ('TCP_KEEPCNT', 3),
+)
+
+STORAGE_VERSION = 1
+STORAGE_KEY = 'denon_avr_net.{0}'
+CACHE_SAVE_DELAY = 60
+DEFAULT_REFRESH_MAX_AGE = 60
+REFRESH_RETRY_INTERVAL = 5
+MAX_PREDICTIONS = 512
+
+STATE_CONNECTING = 'connecting'
+STATE_CONNECTED = 'connected'
+STATE_BACKOFF = 'backoff'
+STATE_STOPPED = 'stopped'
+
+class FrameBuffer:
+    """Reassemble \\r-terminated frames from a TCP byte stream."""
+
+    def __init__(self, max_frame_length=DEFAULT_MAX_FRAME_LENGTH):
+        self.max_frame_length = max_frame_length
+        self.discarded = 0
+        self._buffer = bytearray()
+        self._overflow = False
+
+    def feed(self, data):
+        """Append data and return the list of complete frames it released."""
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        start = 0
+        while True:
+            end = buffer.find(FRAME_TERMINATOR, start)
+            if end == -1:
+                break
+            if self._overflow:
+                # Drop the remainder of a frame that already overflowed
+                self._overflow = False
+            elif end - start > self.max_frame_length:
+                self._discard(end - start)
+            elif end > start:
+                frames.append(buffer[start:end].decode('utf-8', 'replace'))
+            start = end + 1
+        if start:
+            del buffer[:start]
+        if len(buffer) > self.max_frame_length:
+            if not self._overflow:
+                self._discard(len(buffer))
+            self._overflow = True
+            buffer.clear()
+        return frames
+
+    @property
+    def pending(self):
+        """Number of bytes received after the last complete frame."""
+        return len(self._buffer)
+
+    def clear(self):
+        self._buffer.clear()
+        self._overflow = False
+
+    def _discard(self, length):
+        self.discarded += 1
+        _LOGGER.warning('Discarding %d bytes exceeding maximum frame length of %d', length, self.max_frame_length)
+
 class DenonTcpClient(asyncio.Protocol):
-    def __init__(self, host, port):
+    def __init__(
+        self,
+        host,
+        port,
+        max_frame_length=DEFAULT_MAX_FRAME_LENGTH,
+        command_interval=DEFAULT_COMMAND_INTERVAL,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        queue_ttl=DEFAULT_QUEUE_TTL,
+        reconnect_delay=DEFAULT_RECONNECT_DELAY,
+        reconnect_max_delay=DEFAULT_RECONNECT_MAX_DELAY,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        probe_timeout=DEFAULT_PROBE_TIMEOUT,
+        keepalive=False,
+        cache=True,
+        refresh_keys=None,
+        refresh_max_age=DEFAULT_REFRESH_MAX_AGE,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        poll_min_interval=DEFAULT_POLL_MIN_INTERVAL,
+        poll_max_interval=DEFAULT_POLL_MAX_INTERVAL,
+        capture=None,
+        metrics=True,
+        suppress=True,
+        proxy_port=None,
+        proxy_host=DEFAULT_PROXY_HOST,
+    ):
         self.states = {}
+        self.values = {}
+        self.last_frames = {}
+        self.stale_keys = set()
+        self.updated_at = {}
         self.commands = {}
-        self.queue = []
+        self.queue = OfflineQueue(queue_size, queue_ttl)
+        self.frames = FrameBuffer(max_frame_length)
+        self.scheduler = CommandScheduler(self._write, command_interval)
 
         self.listeners = []
+        self.key_listeners = {}
+        self.prefix_listeners = {}
         self.raw_listeners = []
+        self.raw_token_listeners = {}
+        self.raw_prefix_listeners = {}
+        self.flush_listeners = []
+        self._prefix_lengths = []
+        self._raw_prefix_lengths = []
+        self._pending_queries = {}
+        self._query_commands = {}
+        self._query_lengths = []
+        self._current_frame = None
         self.host = host
         self.port = port
         self.loop = None
+        self.transport = None
+        self.writing_paused = False
+        self.connection_state = STATE_STOPPED
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.reconnects = 0
+        self.last_reconnect_time = None
+        self.idle_timeout = idle_timeout
+        self.probe_timeout = probe_timeout
+        self.keepalive = keepalive
+        self.last_frame_time = None
+        self.cache = cache
+        self.first_state_time = None
+        self.first_live_state_time = None
+        self._store = None
+        self._cache_dirty = False
+        self._started_at = None
+        self.refresh_keys = list(refresh_keys or [])
+        self.refresh_max_age = refresh_max_age
+        self._refresh_sent_at = {}
+        self._refresh_handle = None
+        self.poller = None
+        if poll_interval:
+            self.poller = StatusPoller(
+                self,
+                interval=poll_interval,
+                min_interval=poll_min_interval,
+                max_interval=poll_max_interval,
+            )
+        self.capture = TrafficCapture(capture) if capture else None
+        self.metrics = ClientMetrics() if metrics else None
+        self.proxy = TelnetProxy(self, proxy_port, proxy_host) if proxy_port else None
+        self.suppress = suppress
+        self.suppressed = 0
+        self._predictions = {}
+        self._requested_at = {}
+        self._listener_elapsed = 0
+        self._network_loop_task = None
+        self._connection_lost = None
+        self._disconnected_at = None
 
     async def async_added_to_hass(self, hass):
         """Handle when an entity is about to be added to Home Assistant."""
         self.loop = hass.loop
-        self._network_loop_task = hass.loop.create_task(
-            self.start()
-        )
+        self._started_at = hass.loop.time()
+        if self.cache:
+            self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY.format(self.host))
+            await self.async_load_cache()
+        if self.capture is not None:
+            await hass.async_add_executor_job(self.capture.open)
+        self.start()
         hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self.stop_network_read)
 
+    async def async_load_cache(self):
+        """Load the last known states. They are marked stale until the receiver confirms them."""
+        data = await self._store.async_load()
+        if not data:
+            return
+        for key, value in data.get('states', {}).items():
+            if key not in self.states:
+                self.states[key] = value
+                self._set_value(key, value)
+            self.stale_keys.add(key)
+        for key, token in data.get('frames', {}).items():
+            self.last_frames.setdefault(key, token)
+        if self.states:
+            self._first_state('cache')
+
+    def _cache_data(self):
+        self._cache_dirty = False
+        return {
+            'states': self.states,
+            'frames': self.last_frames,
+        }
+
+    def _first_state(self, source):
+        elapsed = self.loop.time() - self._started_at if self._started_at is not None else 0
+        if source == 'receiver':
+            self.first_live_state_time = elapsed
+        if self.first_state_time is None:
+            self.first_state_time = elapsed
+        _LOGGER.info('First state for %s:%s available from %s after %.3f s', self.host, self.port, source, elapsed)
+
     @callback
     def stop_network_read(self, event):
         """Close resources."""
+        self.stop()
+
+    def start(self, loop=None):
+        """Start the connection supervisor unless it is already running."""
+        if loop is not None:
+            self.loop = loop
+        self.scheduler.loop = self.loop
+        if self.capture is not None and not self.capture.is_open:
+            self.capture.open()
+        if self._network_loop_task is None or self._network_loop_task.done():
+            self._network_loop_task = self.loop.create_task(self._supervise())
+            if self.proxy is not None:
+                self.loop.create_task(self.proxy.start())
+        return self._network_loop_task
+
+    def stop(self):
+        self.connection_state = STATE_STOPPED
         if self._network_loop_task:
             self._network_loop_task.cancel()
+            self._network_loop_task = None
+        if self.transport is not None:
+            self.transport.close()
+        if self.proxy is not None:
+            self.proxy.stop()
+        if self.capture is not None:
+            self.capture.close()
 
-    async def start(self):
-        try:
-            _LOGGER.debug('Creating connection to %s:%s', self.host, self.port)
-            transport, _ = await self.loop.create_connection(
-                lambda: self,
-                self.host,
-                self.port,
-            )
-        except Exception as exc:
-            _LOGGER.exception(
-                "Unable to connect to the device at address %s:%s. Will retry. Error: %s",
-                self.host,
-                self.port,
-                exc,
-            )
-            await self._handle_error()
-        else:
-            while True:
+    async def _supervise(self):
+        """Own the connection: connect, wait for it to drop, back off and retry."""
+        delay = self.reconnect_delay
+        while True:
+            self.connection_state = STATE_CONNECTING
+            self._connection_lost = self.loop.create_future()
+            try:
+                _LOGGER.debug('Creating connection to %s:%s', self.host, self.port)
+                await asyncio.wait_for(
+                    self.loop.create_connection(lambda: self, self.host, self.port),
+                    DEFAULT_CONNECT_TIMEOUT,
+                )
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.TimeoutError) as exc:
+                _LOGGER.warning('Unable to connect to %s:%s. Error: %s', self.host, self.port, exc)
+            except Exception:
+                _LOGGER.exception('Unexpected error connecting to %s:%s', self.host, self.port)
+            else:
+                tasks = []
+                if self.idle_timeout:
+                    tasks.append(self.loop.create_task(self._watchdog()))
+                if self.poller is not None:
+                    tasks.append(self.loop.create_task(self.poller.run()))
+                connected_at = self.last_frame_time
                 try:
-                    on_con_lost = self.loop.create_future()
-                    self.request_status()
-                    await on_con_lost
-                except Exception as exc:
-                    _LOGGER.exception(
-                        "Error while reading device at address %s:%s. Error: %s", 
-                        self.host, 
-                        self.port, 
-                        exc
-                    )
-                    await self._handle_error()
-                    break
+                    self.refresh_status()
+                    await self._connection_lost
+                    # A receiver whose only telnet slot is taken accepts and closes right away
+                    if self.last_frame_time > connected_at or self.loop.time() - connected_at >= STABLE_CONNECTION_TIME:
+                        delay = self.reconnect_delay
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    _LOGGER.exception('Unexpected error on the connection to %s:%s', self.host, self.port)
                 finally:
-                    transport.close()
+                    for task in tasks:
+                        task.cancel()
+                    if self.transport is not None:
+                        self.transport.close()
+
+            self.connection_state = STATE_BACKOFF
+            wait = delay * random.uniform(1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER)
+            _LOGGER.debug('Reconnecting to %s:%s in %.2f s', self.host, self.port, wait)
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+    async def _watchdog(self):
+        """Probe a receiver that has been silent for idle_timeout and drop the connection if it does not answer."""
+        while True:
+            idle = self.loop.time() - self.last_frame_time
+            if idle < self.idle_timeout:
+                await asyncio.sleep(self.idle_timeout - idle)
+                continue
+            _LOGGER.debug('No data from %s:%s for %.0f s. Sending probe.', self.host, self.port, idle)
+            try:
+                await self.query(PROBE_COMMAND, timeout=self.probe_timeout)
+            except asyncio.TimeoutError:
+                _LOGGER.warning('No answer to probe from %s:%s. Reconnecting.', self.host, self.port)
+                if self.transport is not None:
+                    self.transport.abort()
+                return
+
+    def _enable_keepalive(self, transport):
+        sock = transport.get_extra_info('socket')
+        if sock is None:
+            return
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for name, value in KEEPALIVE_OPTIONS:
+                if hasattr(socket, name):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+        except OSError as err:
+            _LOGGER.warning('Unable to enable TCP keepalive for %s:%s. Error: %s', self.host, self.port, err)
     
-    def add_listener(self, listener):
-        self.listeners.append(listener)
+    def add_listener(self, listener, key=None, prefix=None, zone=None, replay=False):
+        """Register a state listener and return a callable that removes it.
+
+        Without a filter the listener receives every state change. Otherwise it
+        only receives changes for the exact key, for keys starting with prefix
+        or for keys of the given zone number (e.g. zone2, zone2_vol). With
+        replay the listener is immediately called for every matching state
+        already known so late subscribers start from the current snapshot.
+        """
+        if zone is not None:
+            prefix = 'zone{0}'.format(zone)
+        if key is not None:
+            listeners = self.key_listeners.setdefault(key, [])
+        elif prefix is not None:
+            listeners = self.prefix_listeners.setdefault(prefix, [])
+            self._prefix_lengths = sorted({len(p) for p in self.prefix_listeners})
+        else:
+            listeners = self.listeners
+        listeners.append(listener)
+
+        self._schedule_refresh()
+
+        if replay:
+            if key is not None:
+                snapshot = [(key, self.states[key])] if key in self.states else []
+            else:
+                snapshot = [item for item in self.states.items() if prefix is None or item[0].startswith(prefix)]
+            for state_key, value in snapshot:
+                self._notify_listeners((listener,), state_key, value)
+
+        def remove_listener():
+            if listener in listeners:
+                listeners.remove(listener)
+
+        return remove_listener
 
-    def add_raw_listener(self, listener):
-        self.raw_listeners.append(listener)
+    def add_raw_listener(self, listener, tokens=None, prefixes=None, replay=False):
+        """Register a listener for received frames and return a callable that removes it.
+
+        Without a filter the listener receives every frame. Otherwise it only
+        receives frames equal to one of tokens or starting with one of
+        prefixes, at most once per frame, so the cost of a frame does not grow
+        with the number of entities that do not care about it. With replay the
+        listener is immediately called with the matching frames that produced
+        the currently known states, oldest first.
+        """
+        tokens = [token for token in tokens or () if token]
+        prefixes = [prefix for prefix in prefixes or () if prefix]
+        registrations = []
+        if not tokens and not prefixes:
+            registrations.append(self.raw_listeners)
+        for token in tokens:
+            registrations.append(self.raw_token_listeners.setdefault(token, []))
+        for prefix in prefixes:
+            registrations.append(self.raw_prefix_listeners.setdefault(prefix, []))
+        for listeners in registrations:
+            if listener not in listeners:
+                listeners.append(listener)
+        self._raw_prefix_lengths = sorted({len(p) for p in self.raw_prefix_listeners})
+        self._schedule_refresh()
+
+        if replay:
+            for token in dict.fromkeys(self.last_frames.values()):
+                if registrations[0] is self.raw_listeners or token in tokens or token.startswith(tuple(prefixes)):
+                    self._call_listener('raw', listener, token, self)
+
+        def remove_listener():
+            for listeners in registrations:
+                if listener in listeners:
+                    listeners.remove(listener)
+
+        return remove_listener
+
+    def add_flush_listener(self, listener):
+        """Register a listener called once after all frames of a received chunk.
+
+        Entities can accumulate changes in their state listeners and write
+        their Home Assistant state once per chunk from the flush listener.
+        """
+        self.flush_listeners.append(listener)
+
+        def remove_listener():
+            if listener in self.flush_listeners:
+                self.flush_listeners.remove(listener)
+
+        return remove_listener
 
-    async def _handle_error(self):
-        """Handle error for TCP/IP connection."""
-        await asyncio.sleep(5)
-        
     def connection_made(self, transport):
         _LOGGER.debug('Connection established at %s:%s: %s', self.host, self.port, transport)
 
         self.transport = transport
-        
-        while self.queue:
-            self.send(self.queue.pop(0))
+        self.writing_paused = False
+        self.connection_state = STATE_CONNECTED
+        self.last_frame_time = self.loop.time()
+        self.frames.clear()
+        if self.capture is not None:
+            self.capture.record(DIRECTION_CONNECT)
+        if self.keepalive:
+            self._enable_keepalive(transport)
+        if self._disconnected_at is not None:
+            self.reconnects += 1
+            self.last_reconnect_time = self.loop.time() - self._disconnected_at
+            self._disconnected_at = None
+            _LOGGER.info('Reconnected to %s:%s after %.2f s', self.host, self.port, self.last_reconnect_time)
+        self.scheduler.resume()
+
+        for data, priority in self.queue.drain():
+            self.scheduler.push(data, priority)
 
     def connection_lost(self, exc):
-        _LOGGER.exception("Connection lost. Attempting to reconnect. Error: %s", exc)
-        self.loop.create_task(
-            self.start()
-        )
+        if self.connection_state == STATE_STOPPED:
+            _LOGGER.debug('Connection to %s:%s closed', self.host, self.port)
+        else:
+            _LOGGER.warning('Connection to %s:%s lost. Error: %s', self.host, self.port, exc)
+        self.transport = None
+        self.writing_paused = False
+        self.scheduler.pause()
+        # Commands not written yet get the offline queue's size limit and TTL
+        self.queue.prepend(self.scheduler.drain())
+        # Answers to queries sent on this connection will not arrive
+        self._refresh_sent_at.clear()
+        if self.capture is not None:
+            self.capture.flush()
+        self._disconnected_at = self.loop.time()
+        if self._connection_lost is not None and not self._connection_lost.done():
+            self._connection_lost.set_result(exc)
+
+    def pause_writing(self):
+        _LOGGER.debug('Transport buffer full. Holding back commands for %s:%s', self.host, self.port)
+        self.writing_paused = True
+        self.scheduler.pause()
+
+    def resume_writing(self):
+        _LOGGER.debug('Transport buffer drained. Resuming commands for %s:%s', self.host, self.port)
+        self.writing_paused = False
+        for data, priority in self.queue.drain():
+            self.scheduler.push(data, priority)
+        self.scheduler.resume()
 
     def data_received(self, data):
-        _LOGGER.debug('Data received: %s', data.decode())
-        for token in data.decode().split('\r'):
-            for listener in self.raw_listeners:
-                try:
-                    listener(token, self)
-                except Exception as err:
-                    _LOGGER.error('Error invoking raw listener: %s', err)
+        _LOGGER.debug('Data received: %r', data)
+        self.last_frame_time = self.loop.time()
+        if self.metrics is not None:
+            self.metrics.bytes_in += len(data)
+            self.metrics.chunks_in += 1
+        if self.capture is not None:
+            self.capture.record(DIRECTION_IN, data)
+        if self.proxy is not None:
+            self.proxy.broadcast(data)
+        tokens = self.frames.feed(data)
+        for token in tokens:
+            self.frame_received(token)
+        if tokens:
+            for listener in self.flush_listeners:
+                self._call_listener('flush', listener, self)
 
-            if token != '':
-                self.set_state('raw_command', token)
-            
+    def frame_received(self, token):
+        for listener in self.raw_listeners:
+            self._call_listener('raw', listener, token, self)
+        routed = self._route_raw(token)
+        if routed:
+            for listener in routed:
+                self._call_listener('raw', listener, token, self)
+
+        self._current_frame = token
+        if self.metrics is None:
+            self.set_state('raw_command', token)
+            self.parse(token)
+        else:
+            # Parse time excludes the state listeners called while parsing
+            self._listener_elapsed = 0
+            started = perf_counter()
+            self.set_state('raw_command', token)
             self.parse(token)
+            self.metrics.frames_in += 1
+            self.metrics.parse_time.add(perf_counter() - started - self._listener_elapsed)
+        self._current_frame = None
+
+        if self._pending_queries:
+            self._resolve_queries(token)
+
+    def _route_raw(self, token):
+        """Return the filtered raw listeners for a frame, each listener once."""
+        routed = self.raw_token_listeners.get(token)
+        for length in self._raw_prefix_lengths:
+            if length > len(token):
+                break
+            listeners = self.raw_prefix_listeners.get(token[:length])
+            if not listeners:
+                continue
+            if not routed:
+                routed = listeners
+            else:
+                routed = routed + [listener for listener in listeners if listener not in routed]
+        return routed
+
+    async def query(self, command, expect_prefix=None, timeout=DEFAULT_QUERY_TIMEOUT, priority=PRIORITY_USER):
+        """Send a query such as PW? and return the first frame starting with expect_prefix.
+
+        The prefix defaults to the command without its trailing question mark.
+        Concurrent queries for the same prefix wait for the same frame and
+        deadline, and identical ones share a single request. Raises
+        asyncio.TimeoutError if no matching frame arrives.
+        """
+        if expect_prefix is None:
+            expect_prefix = command.rstrip('? ')
+        future = self._pending_queries.get(expect_prefix)
+        if future is None:
+            future = self._expect_frame(expect_prefix, timeout)
+        commands = self._query_commands.setdefault(expect_prefix, set())
+        if command not in commands:
+            commands.add(command)
+            self.send(encode_command(command), priority)
+        return await asyncio.shield(future)
+
+    async def run_sequence(self, steps, force=False, timeout=DEFAULT_QUERY_TIMEOUT):
+        """Run (command, wait, expect) steps in order and return the number of steps completed.
 
-    def send(self, data):
-        if hasattr(self, 'transport'):
-            self.transport.write(data)
+        Commands are queued back to back and written at the scheduler's pacing
+        without waiting for the receiver in between. A step with expect holds
+        the following steps until a frame starting with expect arrives, and
+        the sequence stops if none arrives within timeout seconds. A step with
+        wait pauses for that many seconds before the next step is queued.
+        """
+        for index, (command, wait, expect) in enumerate(steps):
+            # Registered after queueing since the scheduler never writes synchronously
+            sent = self.send(encode_command(command), force=force)
+            if expect and sent:
+                future = self._pending_queries.get(expect) or self._expect_frame(expect, timeout)
+                try:
+                    await asyncio.shield(future)
+                except asyncio.TimeoutError:
+                    _LOGGER.warning('No %s received after %s. Stopping the sequence at step %s', expect, command, index + 1)
+                    return index
+            if wait:
+                await asyncio.sleep(wait)
+        return len(steps)
+
+    def _expect_frame(self, expect_prefix, timeout):
+        """Return a future resolved with the next frame starting with expect_prefix."""
+        future = self.loop.create_future()
+        self._pending_queries[expect_prefix] = future
+        self._update_query_lengths()
+        expire = self.loop.call_later(timeout, self._expire_query, expect_prefix, future)
+        future.add_done_callback(lambda _: expire.cancel())
+        return future
+
+    def _resolve_queries(self, token):
+        for length in self._query_lengths:
+            future = self._pending_queries.pop(token[:length], None)
+            if future is not None:
+                self._query_commands.pop(token[:length], None)
+                if not future.done():
+                    future.set_result(token)
+                self._update_query_lengths()
+                return
+
+    def _expire_query(self, expect_prefix, future):
+        if self._pending_queries.get(expect_prefix) is future:
+            del self._pending_queries[expect_prefix]
+            self._query_commands.pop(expect_prefix, None)
+            self._update_query_lengths()
+        if not future.done():
+            _LOGGER.debug('Query for %s timed out', expect_prefix)
+            future.set_exception(asyncio.TimeoutError())
+
+    def _update_query_lengths(self):
+        self._query_lengths = sorted({len(prefix) for prefix in self._pending_queries}, reverse=True)
+
+    def send_command(self, command, priority=PRIORITY_USER, force=False):
+        """Send a command such as MVUP, appending the \\r terminator."""
+        return self.send(encode_command(command), priority, force)
+
+    def send_threadsafe(self, data, priority=PRIORITY_USER, force=False):
+        """Send from a thread other than the event loop's, e.g. a sync entity method run in the executor."""
+        self.loop.call_soon_threadsafe(self.send, data, priority, force)
+
+    def send(self, data, priority=PRIORITY_USER, force=False):
+        """Queue data for the receiver. Must be called from the event loop.
+
+        Unless force is set, a command whose echo would not change any known
+        state (e.g. ZMON while zone 1 is on) is skipped. Returns False if the
+        command was skipped.
+        """
+        predicted = self._predict(data)
+        if predicted and self.transport is not None and not force and self.suppress and self._is_redundant(predicted):
+            _LOGGER.debug('Skipping command that would not change anything: %r', data)
+            self.suppressed += 1
+            return False
+        if predicted:
+            now = self.loop.time()
+            for key, value in predicted:
+                self._requested_at[key] = (now, value)
+        if self.transport is not None and not self.writing_paused:
+            self.scheduler.push(data, priority)
         else:
-            _LOGGER.debug('No transport available. Queueing data: %s', repr(data))
-            self.queue.append(data)
+            # Bounded and expiring, unlike the scheduler
+            _LOGGER.debug('Not writing. Queueing data: %s', repr(data))
+            self.queue.push(data, priority)
+        if self.metrics is not None:
+            self.metrics.queue_depth.add(self.queue_depth)
+        return True
+
+    def _predict(self, data):
+        predicted = self._predictions.get(data)
+        if predicted is None:
+            if len(self._predictions) >= MAX_PREDICTIONS:
+                self._predictions.clear()
+            predicted = self._predictions[data] = predict_states(data.rstrip(b'\r').decode('utf-8', 'replace'))
+        return predicted
+
+    def _is_redundant(self, predicted):
+        """Return True if every predicted state is already known and confirmed.
+
+        A state is not confirmed while the echo of the last command that set
+        it is outstanding or that command set a different value, since the
+        receiver may still apply it.
+        """
+        for key, value in predicted:
+            if self.states.get(key) != value or key in self.stale_keys:
+                return False
+            requested = self._requested_at.get(key)
+            if requested is not None:
+                requested_time, requested_value = requested
+                if requested_value != value or requested_time >= (self.updated_at.get(key) or 0):
+                    return False
+        return True
+
+    def _write(self, data):
+        _LOGGER.debug('Data sent: %r', data)
+        if self.metrics is not None:
+            self.metrics.bytes_out += len(data)
+            self.metrics.frames_out += 1
+        if self.capture is not None:
+            self.capture.record(DIRECTION_OUT, data)
+        self.transport.write(data)
+
+    @property
+    def queue_depth(self):
+        """Number of commands waiting to be written to the receiver."""
+        return self.scheduler.depth + len(self.queue)
+
+    @property
+    def dropped_commands(self):
+        """Number of queued commands superseded by a newer command, expired or dropped for space."""
+        return self.scheduler.dropped + self.queue.dropped
 
     def set_state(self, key, value):
+        self.updated_at[key] = self.last_frame_time
+        if self.states.get(key) == value and key not in self.stale_keys:
+            return
+        self.stale_keys.discard(key)
         self.states[key] = value
+        self._set_value(key, value)
+        if self.first_live_state_time is None:
+            self._first_state('receiver')
+        if self._store is not None and not self._cache_dirty:
+            # Written at most once per CACHE_SAVE_DELAY and on shutdown
+            self._cache_dirty = True
+            self._store.async_delay_save(self._cache_data, CACHE_SAVE_DELAY)
+        if self._current_frame is not None:
+            # Remember the frame behind each state for raw listener replay
+            self.last_frames.pop(key, None)
+            self.last_frames[key] = self._current_frame
         _LOGGER.debug('STATE SET: %s = %s', key, value)
-        for listener in self.listeners:
+        self._notify_listeners(self.listeners, key, value)
+        listeners = self.key_listeners.get(key)
+        if listeners:
+            self._notify_listeners(listeners, key, value)
+        for length in self._prefix_lengths:
+            listeners = self.prefix_listeners.get(key[:length])
+            if listeners:
+                self._notify_listeners(listeners, key, value)
+
+    def _set_value(self, key, value):
+        typed = decode_value(key, value)
+        if typed is not None:
+            self.values[key] = typed
+        else:
+            self.values.pop(key, None)
+
+    def _notify_listeners(self, listeners, key, value):
+        for listener in listeners:
+            self._call_listener('state', listener, key, value, self)
+
+    def _call_listener(self, kind, listener, *args):
+        if self.metrics is None:
             try:
-                listener(key, value, self)
+                listener(*args)
             except Exception as err:
-                _LOGGER.error('Error invoking raw listener: %s', err)
-    
+                _LOGGER.error('Error invoking %s listener: %s', kind, err)
+            return
+        started = perf_counter()
+        try:
+            listener(*args)
+        except Exception as err:
+            _LOGGER.error('Error invoking %s listener: %s', kind, err)
+        elapsed = perf_counter() - started
+        self._listener_elapsed += elapsed
+        self.metrics.listener_time(listener, elapsed)
+
+    def get_metrics(self):
+        """Return the metrics plus the current connection and queue figures."""
+        data = self.metrics.as_dict() if self.metrics is not None else {}
+        now = self.loop.time() if self.loop is not None else None
+        data.update({
+            'connection_state': self.connection_state,
+            'reconnects': self.reconnects,
+            'last_reconnect_s': self.last_reconnect_time,
+            'last_frame_age_s': round(now - self.last_frame_time, 1) if self.last_frame_time is not None else None,
+            'send_queue_depth': self.queue_depth,
+            'dropped_commands': self.dropped_commands,
+            'discarded_frames': self.frames.discarded,
+            'stale_states': len(self.stale_keys),
+            'suppressed_commands': self.suppressed,
+            'first_state_s': round(self.first_state_time, 3) if self.first_state_time is not None else None,
+            'first_live_state_s': round(self.first_live_state_time, 3) if self.first_live_state_time is not None else None,
+        })
+        if self.proxy is not None:
+            data['proxy_sessions'] = len(self.proxy.sessions)
+            data['proxy_commands'] = self.proxy.commands
+        return data
+
     def get_state(self, key):
         if key in self.states:
             return self.states[key]
         else:
             return ''
 
+    def get_value(self, key, default=None):
+        """Return the typed value of a state: a bool for power and mute, a Volume for volumes and channel levels."""
+        return self.values.get(key, default)
+
+    def get_channel_levels(self, zone):
+        """Return the channel name -> Volume levels known for a zone number."""
+        prefix = 'zone{0}_ch_vol_'.format(zone)
+        return {key[len(prefix):]: value for key, value in self.values.items() if key.startswith(prefix)}
+
     def parse(self, data):
-        # Parse zone state
-        if data.startswith('PW'):
-            self.set_state('power', data[2:])
-        elif data.startswith('CV'):
-            self.set_zone_state('zone1', data)
-        elif data.startswith('SI'):
-            self.set_zone_state('zone1', data[2:])
-        elif data.startswith('Z2'):
-            self.set_zone_state('zone2', data[2:])
-        elif data.startswith('Z3'):
-            self.set_zone_state('zone3', data[2:])
-        # Parse max volume BEFORE main volume
-        elif data.startswith('MVMAX'):
-            self.set_state('zone1_vol_max', data[6:])
-        # Parse main zone attributes
-        elif data.startswith('MV'):
-            self.set_state('zone1_vol', data[2:])
-        elif data.startswith('MU'):
-            self.set_state('zone1_mute', data[2:])
-        elif data.startswith('ZM'):
-            self.set_state('zone1', data[2:])
-        # Parse Video Select
-        elif data.startswith('SV'):
-            self.set_state('video_select', data[2:])
-        
+        decode_frame(self, data)
+
     def set_zone_state(self, key, state):
-        # Parse zone state
-        if state == 'ON' or state == 'OFF':
-            self.set_state(key, state)
-        # Parse mute
-        elif state == 'MUON' or state == 'MUOFF':
-            self.set_state('{0}_mute'.format(key), state[2:])
-        # Parse quick select
-        elif state.startswith('QUICK'):
-            self.set_state('{0}_quick'.format(key), state[-1:])
-        # Parse channel setting
-        elif state.startswith('CS'):
-            self.set_zone_state('{0}_ch_set'.format(key), state[2:])
-        # Parse channel volume
-        elif state.startswith('CV'):
-            if state != 'CVEND' and ' ' in state:
-                # Parse channel volume
-                self.set_state('{0}_ch_vol_{1}'.format(key, state[2:].split()[0]), state[2:].split()[1])
-        # Parse HPF
-        elif state.startswith('HPF'):
-            self.set_state('{0}_hpf'.format(key), state[3:])
-        # Parse Zone2/3 volume
-        elif state.isnumeric() == True:
-            self.set_state(key + '_vol', state)
-        # Otherwise this is source
-        else:
-            self.set_state(key + '_source', state)
+        decode_zone(self, key, state)
 
     def request_status(self):
-        self.send(b'PW?\r')
-        self.send(b'MV?\r')
-        self.send(b'CV?\r')
-        self.send(b'MU?\r')
-        self.send(b'SI?\r')
-        self.send(b'ZM?\r')
-        self.send(b'SR?\r')
-        self.send(b'SD?\r')
-        self.send(b'DC?\r')
-        self.send(b'SV?\r')
-        self.send(b'SLP?\r')
-        self.send(b'MS?\r')
-        self.send(b'Z2?\r')
-        self.send(b'Z2MU?\r')
-        self.send(b'Z2CS?\r')
-        self.send(b'Z2CV?\r')
-        self.send(b'Z2HPF?\r')
-        self.send(b'Z2QUICK ?\r')
-        self.send(b'Z3?\r')
-        self.send(b'Z3MU?\r')
-        self.send(b'Z3CS?\r')
-        self.send(b'Z3CV?\r')
-        self.send(b'Z3HPF?\r')
-        self.send(b'Z3QUICK ?\r')
-        self.send(b'SSSPC ?\r')
-        self.send(b'PSCLV ?\r')
-        self.send(b'PSSWL ?\r')
-        self.send(b'SSLEV ?\r')
\ No newline at end of file
+        """Query everything the client knows how to query."""
+        for query, _ in STATUS_QUERIES:
+            self.send(query, PRIORITY_STATUS)
+
+    def refresh_status(self):
+        """Query only the states in use that are missing, stale or older than refresh_max_age.
+
+        States in use are the configured refresh_keys plus the keys and
+        prefixes of filtered listeners and the states of every query whose
+        answer a filtered raw listener routes. Unfiltered state and raw
+        listeners need every state unless refresh_keys is configured.
+        """
+        self._refresh_handle = None
+        if self.transport is None:
+            return
+        now = self.loop.time()
+        patterns = set(self.refresh_keys)
+        patterns.update(key for key, listeners in self.key_listeners.items() if listeners)
+        patterns.update(prefix + '*' for prefix, listeners in self.prefix_listeners.items() if listeners)
+        everything = not self.refresh_keys and (len(self.listeners) > 0 or len(self.raw_listeners) > 0)
+        raw_filters = [token for token, listeners in self.raw_token_listeners.items() if listeners]
+        raw_filters.extend(prefix for prefix, listeners in self.raw_prefix_listeners.items() if listeners)
+
+        sent = 0
+        for query, keys in STATUS_QUERIES:
+            if now - self._refresh_sent_at.get(query, -REFRESH_RETRY_INTERVAL) < REFRESH_RETRY_INTERVAL:
+                continue
+            if not everything:
+                stem = query_stem(query)
+                if not any(frames_overlap(stem, raw_filter) for raw_filter in raw_filters):
+                    keys = [key for key in keys if any(patterns_overlap(key, pattern) for pattern in patterns)]
+                    if not keys:
+                        continue
+            if keys and not self._needs_refresh(keys, now):
+                continue
+            self._refresh_sent_at[query] = now
+            self.send(query, PRIORITY_STATUS)
+            sent += 1
+        _LOGGER.debug('Refreshing %s:%s with %d of %d status queries', self.host, self.port, sent, len(STATUS_QUERIES))
+
+    def _needs_refresh(self, keys, now):
+        for pattern in keys:
+            matched = [key for key in self.states if key_matches(pattern, key)]
+            if not matched:
+                return True
+            for key in matched:
+                updated = self.updated_at.get(key)
+                if key in self.stale_keys or updated is None or now - updated > self.refresh_max_age:
+                    return True
+        return False
+
+    def _schedule_refresh(self):
+        """Refresh once for all subscriptions made in the same event loop iteration."""
+        if self._refresh_handle is None and self.transport is not None:
+            self._refresh_handle = self.loop.call_soon(self.refresh_status)
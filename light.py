@@ -11,6 +11,8 @@ from homeassistant.core import callback
 from homeassistant.helpers import config_validation as cv, entity_platform, service
 
 from . import DOMAIN
+from .optimistic_state import DEFAULT_OPTIMISTIC_TIMEOUT
+from .protocol import encode_command, parse_volume
 from .switch import DenonNetworkSwitch
 
 _LOGGER = logging.getLogger(__name__)
@@ -76,7 +78,7 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         {
             vol.Exclusive(ATTR_BRIGHTNESS, ATTR_BRIGHTNESS): VALID_BRIGHTNESS,
         },
-        "set_brightness",
+        "async_set_brightness",
     )
 
     async_add_entities(entities, True)
@@ -112,6 +114,10 @@ class DenonNetworkLight(DenonNetworkSwitch):
         self._brightness = None
         self._attributes = {}
         self._space_after_prefix = space_after_prefix
+        self._level_commands = [
+            encode_command('{0}{1}{2:02d}'.format(level_prefix, ' ' if space_after_prefix else '', value))
+            for value in range(min, max + 1)
+        ]
 
         DenonNetworkSwitch.__init__(self, name, host, port, on_command, off_command, icon, None, None)
 
@@ -130,27 +136,31 @@ class DenonNetworkLight(DenonNetworkSwitch):
             return False
 
         self._client = self.hass.data[DOMAIN][self._host]['client']
-        self._client.add_raw_listener(self.client_raw_data_received)
+        self._optimistic.timeout = self.hass.data[DOMAIN][self._host].get('optimistic_timeout', DEFAULT_OPTIMISTIC_TIMEOUT)
+        self._remove_listeners.append(self._client.add_flush_listener(self.client_data_flushed))
+        self._remove_listeners.append(self._client.add_raw_listener(
+            self.client_raw_data_received,
+            tokens=(self.on_command, self.off_command),
+            prefixes=(self._level_prefix,),
+            replay=True,
+        ))
         
     def client_raw_data_received(self, data, client):
         updated = False
         if data == '':
             return
         if data == self.on_command:
-            self._state = STATE_ON
-            updated = True
+            updated = self._optimistic.apply('_state', STATE_ON)
         elif data == self.off_command:
-            self._state = STATE_OFF
-            updated = True
+            updated = self._optimistic.apply('_state', STATE_OFF)
         elif data.startswith(self._level_prefix):
-            level_str = data[len(self._level_prefix) + (1 if self._space_after_prefix else 0):]
-            if level_str.isnumeric() == True:
-                raw_value = int(level_str)
-                self.set_brightness(int(255 * (raw_value - self._min) / (self._max - self._min)))
-                updated = True
+            # Levels may be half steps (MV505, CVC 505)
+            level = parse_volume(data[len(self._level_prefix):])
+            if level is not None:
+                updated = self._optimistic.apply('_brightness', self._level_brightness(int(level + 0.5)))
         if updated:
             _LOGGER.debug("State updated (%s): %s brightness = %s", self.name, self._state, self._brightness)
-            self.async_write_ha_state()
+            self._update_pending = True
 
     @property
     def supported_features(self):
@@ -167,14 +177,21 @@ class DenonNetworkLight(DenonNetworkSwitch):
         """Return the attributes of the entity (if any JSON present)."""
         return self._attributes
 
-    def turn_on(self, **kwargs):
-        DenonNetworkSwitch.turn_on(self)
+    async def async_turn_on(self, **kwargs):
+        await DenonNetworkSwitch.async_turn_on(self)
         brightness = kwargs.get(ATTR_BRIGHTNESS, 255)
         if brightness != self._brightness:
-            self.set_brightness(brightness)
-            raw_value = int(self._brightness * (self._max - self._min) / 255 + self._min)
+            raw_value = int(brightness * (self._max - self._min) / 255 + self._min)
             _LOGGER.debug('Sending command %s%s%s', self._level_prefix, ' ' if self._space_after_prefix else '', raw_value)
-            self._client.send('{0}{1}{2:02d}\r'.format(self._level_prefix, ' ' if self._space_after_prefix else '', raw_value).encode('utf-8'))
+            # Expect the brightness the echoed level maps back to
+            if self._client.send(self._level_commands[raw_value - self._min]):
+                self._optimistic.expect('_brightness', self._level_brightness(raw_value))
+
+    def _level_brightness(self, raw_value):
+        return int(255 * (raw_value - self._min) / (self._max - self._min))
+
+    async def async_set_brightness(self, brightness):
+        self.set_brightness(brightness)
 
     def set_brightness(self, brightness):
         _LOGGER.debug('Setting brightness to %s', brightness)
@@ -8,12 +8,17 @@ from homeassistant.components.switch import PLATFORM_SCHEMA
 from homeassistant.const import CONF_NAME, CONF_VALUE_TEMPLATE, EVENT_HOMEASSISTANT_STOP, STATE_ON, STATE_OFF
 from homeassistant.const import CONF_HOST, CONF_PORT, CONF_SOURCE, CONF_TYPE, CONF_ICON
 from homeassistant.core import callback
+from homeassistant.helpers import entity_platform
 import homeassistant.helpers.config_validation as cv
 from homeassistant.components.media_player import MediaPlayerEntity, SUPPORT_SELECT_SOURCE, SUPPORT_TURN_ON, SUPPORT_TURN_OFF
 from homeassistant.components.media_player import SUPPORT_VOLUME_MUTE, SUPPORT_VOLUME_SET, SUPPORT_VOLUME_STEP
+from homeassistant.components.media_player.const import ATTR_MEDIA_VOLUME_LEVEL
 
 from . import DOMAIN
 from . import DenonTcpClient
+from .optimistic_state import OptimisticState, DEFAULT_OPTIMISTIC_TIMEOUT
+from .protocol import ZONE_SPECS, ZONES, encode_command, parse_volume, volume_step
+from .volume_ramp import VolumeRamp
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -25,11 +30,15 @@ CONF_VOL_UP_COMMAND = "vol_up_command"
 CONF_VOL_DOWN_COMMAND = "vol_down_command"
 CONF_VOL_PREFIX = "vol_prefix"
 CONF_SOURCE_PREFIX = "source_prefix"
+CONF_ZONE = "zone"
 CONF_ZONES = "zones"
 CONF_SOURCES = "sources"
 CONF_MIN = "min"
 CONF_MAX = "max"
 
+ATTR_DURATION = "duration"
+SERVICE_FADE_VOLUME = "fade_volume"
+
 DEFAULT_PORT = 23
 
 SOURCE_SCHEMA = vol.Schema(
@@ -39,22 +48,50 @@ SOURCE_SCHEMA = vol.Schema(
     }
 )
 
-ZONE_SCHEMA = vol.Schema(
+ZONE_COMMANDS = (
+    CONF_ON_COMMAND,
+    CONF_OFF_COMMAND,
+    CONF_MUTE_ON_COMMAND,
+    CONF_MUTE_OFF_COMMAND,
+    CONF_VOL_UP_COMMAND,
+    CONF_VOL_DOWN_COMMAND,
+    CONF_VOL_PREFIX,
+    CONF_SOURCE_PREFIX,
+)
+
+def zone_commands(config):
+    """Fill in the commands of a zone number from the protocol spec. Explicit commands take precedence."""
+    if CONF_ZONE in config:
+        config = {**ZONES[config[CONF_ZONE]].entity_config(), **config}
+    missing = [key for key in ZONE_COMMANDS if key not in config]
+    if missing:
+        raise vol.Invalid('Either zone or {0} must be specified'.format(', '.join(missing)))
+    return config
+
+def standard_zone(config):
+    """Return the number of the zone whose standard commands the config uses, or None for custom commands."""
+    for spec in ZONE_SPECS:
+        if all(config[key] == value for key, value in spec.entity_config().items()):
+            return spec.number
+    return None
+
+ZONE_SCHEMA = vol.All(vol.Schema(
     {
         vol.Required(CONF_NAME): cv.string,
-        vol.Required(CONF_ON_COMMAND): cv.string,
-        vol.Required(CONF_OFF_COMMAND): cv.string,
-        vol.Required(CONF_MUTE_ON_COMMAND): cv.string,
-        vol.Required(CONF_MUTE_OFF_COMMAND): cv.string,
-        vol.Required(CONF_VOL_UP_COMMAND): cv.string,
-        vol.Required(CONF_VOL_DOWN_COMMAND): cv.string,
-        vol.Required(CONF_VOL_PREFIX): cv.string,
-        vol.Required(CONF_SOURCE_PREFIX): cv.string,
+        vol.Optional(CONF_ZONE): vol.In(list(ZONES)),
+        vol.Optional(CONF_ON_COMMAND): cv.string,
+        vol.Optional(CONF_OFF_COMMAND): cv.string,
+        vol.Optional(CONF_MUTE_ON_COMMAND): cv.string,
+        vol.Optional(CONF_MUTE_OFF_COMMAND): cv.string,
+        vol.Optional(CONF_VOL_UP_COMMAND): cv.string,
+        vol.Optional(CONF_VOL_DOWN_COMMAND): cv.string,
+        vol.Optional(CONF_VOL_PREFIX): cv.string,
+        vol.Optional(CONF_SOURCE_PREFIX): cv.string,
         vol.Optional(CONF_MIN, default=0): cv.positive_int,
         vol.Optional(CONF_MAX, default=99): cv.positive_int,
         vol.Optional(CONF_SOURCES, default=[]): vol.All(cv.ensure_list, [SOURCE_SCHEMA]),
     }
-)
+), zone_commands)
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
@@ -105,9 +142,21 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
                 zone_config[CONF_MAX],
                 zone_config[CONF_ICON] if CONF_ICON in zone_config else None,
                 zone_sources,
+                standard_zone(zone_config),
             )
         )
 
+    platform = entity_platform.current_platform.get()
+
+    platform.async_register_entity_service(
+        SERVICE_FADE_VOLUME,
+        {
+            vol.Required(ATTR_MEDIA_VOLUME_LEVEL): cv.small_float,
+            vol.Required(ATTR_DURATION): vol.All(vol.Coerce(float), vol.Range(min=0)),
+        },
+        "async_fade_volume",
+    )
+
     async_add_entities(entities, True)
 
 class DenonNetworkMediaPlayer(MediaPlayerEntity):
@@ -130,6 +179,7 @@ class DenonNetworkMediaPlayer(MediaPlayerEntity):
         max,
         icon,
         sources,
+        zone=None,
     ):
         """Initialize the network client."""
         self._name = name
@@ -147,13 +197,34 @@ class DenonNetworkMediaPlayer(MediaPlayerEntity):
         self._max = max
         self._icon = icon
         self._sources = sources
+        self._zone = zone
+        self._zone_key = 'zone{0}'.format(zone) if zone else None
+        # First configured name wins when several names share a source code
+        self._source_names = {code: source for source, code in reversed(list(sources.items()))}
         self._source_list = []
+        # Commands are encoded once so actions send them without formatting
+        commands = (on_command, off_command, mute_on_command, mute_off_command, vol_up_command, vol_down_command)
+        if zone:
+            # A standard zone's commands are encoded in its protocol spec
+            spec_commands = ZONES[zone].commands
+            names = ('on', 'off', 'mute_on', 'mute_off', 'volume_up', 'volume_down')
+            self._commands = {command: spec_commands[name] for command, name in zip(commands, names)}
+            self._source_query = spec_commands['source_query']
+        else:
+            self._commands = {command: encode_command(command) for command in commands}
+            self._source_query = encode_command(source_prefix + '?')
+        self._volume_commands = [encode_command('{0}{1:02d}'.format(vol_prefix, value)) for value in range(min, max + 1)]
+        self._source_commands = {source: encode_command(source_prefix + code) for source, code in sources.items()}
         self._network_loop_task = None
         self._client = None
         self._state = None
         self._volume = None
         self._mute = None
         self._source = None
+        self._update_pending = False
+        self._optimistic = OptimisticState(self)
+        self._ramp = None
+        self._remove_listeners = []
 
         for source in self._sources:
             _LOGGER.debug('Adding source to list: %s', source)
@@ -172,45 +243,85 @@ class DenonNetworkMediaPlayer(MediaPlayerEntity):
             return False
 
         self._client = self.hass.data[DOMAIN][self._host]['client']
-        self._client.add_raw_listener(self.client_raw_data_received)
+        self._optimistic.timeout = self.hass.data[DOMAIN][self._host].get('optimistic_timeout', DEFAULT_OPTIMISTIC_TIMEOUT)
+        self._ramp = VolumeRamp(self._client, self._vol_prefix, volume_step(self._vol_prefix), self._name)
+        self._remove_listeners.append(self._client.add_flush_listener(self.client_data_flushed))
+        if self._zone:
+            # Standard zone commands: use the states the client decoded
+            self._remove_listeners.append(self._client.add_listener(self.client_data_received, zone=self._zone, replay=True))
+        else:
+            self._remove_listeners.append(self._client.add_raw_listener(
+                self.client_raw_data_received,
+                tokens=(self._on_command, self._off_command, self._mute_on_command, self._mute_off_command),
+                prefixes=(self._vol_prefix, self._source_prefix),
+                replay=True,
+            ))
+
+    async def async_will_remove_from_hass(self):
+        for remove_listener in self._remove_listeners:
+            remove_listener()
+        self._remove_listeners = []
+        self._optimistic.cancel()
+        if self._ramp is not None:
+            self._ramp.cancel()
+
+    def client_data_received(self, key, value, client):
+        suffix = key[len(self._zone_key):]
+        typed = client.get_value(key)
+        updated = False
+        if suffix == '':
+            if typed is not None:
+                updated = self._optimistic.apply('_state', STATE_ON if typed else STATE_OFF)
+        elif suffix == '_mute':
+            if typed is not None:
+                updated = self._optimistic.apply('_mute', typed)
+        elif suffix == '_vol':
+            if typed is not None:
+                self._ramp.received(typed.level)
+                updated = self._optimistic.apply('_volume', self._normalize_volume(typed.level))
+        elif suffix == '_source':
+            source = self._source_names.get(value)
+            if source is not None:
+                updated = self._optimistic.apply('_source', source)
+        if updated:
+            _LOGGER.debug('%s: %s = %s', self._name, key, value)
+            self._update_pending = True
 
     def client_raw_data_received(self, data, client):
         updated = False
         if data == '':
             return
         if data == self._on_command:
-            self._state = STATE_ON
-            updated = True
+            updated = self._optimistic.apply('_state', STATE_ON)
             _LOGGER.debug('%s: Power on', self._name)
         elif data == self._off_command:
-            self._state = STATE_OFF
-            updated = True
+            updated = self._optimistic.apply('_state', STATE_OFF)
             _LOGGER.debug('%s: Power off', self._name)
         elif data == self._mute_on_command:
-            self._mute = True
-            updated = True
+            updated = self._optimistic.apply('_mute', True)
             _LOGGER.debug('%s: Mute on', self._name)
         elif data == self._mute_off_command:
-            self._mute = False
-            updated = True
+            updated = self._optimistic.apply('_mute', False)
             _LOGGER.debug('%s: Mute off', self._name)
-        elif data.startswith(self._vol_prefix):
-            raw_value = data[len(self._source_prefix):]
-            if raw_value.isnumeric() == True:
-                int_value = int(raw_value) if len(raw_value) == 2 else int(raw_value) / 10
-                self.set_volume((int_value - self._min) / (self._max - self._min))
-                updated = True
+        else:
+            # Zones 2 and up share one prefix for volume and source (Z250, Z2CD)
+            level = parse_volume(data[len(self._vol_prefix):]) if data.startswith(self._vol_prefix) else None
+            if level is not None:
+                self._ramp.received(level)
+                updated = self._optimistic.apply('_volume', self._normalize_volume(level))
                 _LOGGER.debug('%s Volume: %s', self._name, self._volume)
-        elif data.startswith(self._source_prefix) and updated == False:
-            raw_value = data[len(self._source_prefix):]
-            for source in self._sources:
-                if self._sources[source] == raw_value and source != self._source:
+            elif data.startswith(self._source_prefix):
+                source = self._source_names.get(data[len(self._source_prefix):])
+                if source is not None:
                     _LOGGER.debug('%s Set source: %s', self._name, source)
-                    self._source = source
-                    updated = True
-                    break
+                    updated = self._optimistic.apply('_source', source)
 
         if updated:
+            self._update_pending = True
+
+    def client_data_flushed(self, client):
+        if self._update_pending:
+            self._update_pending = False
             self.async_write_ha_state()
 
     @property
@@ -245,19 +356,31 @@ class DenonNetworkMediaPlayer(MediaPlayerEntity):
     def volume_level(self):
         return self._volume
 
-    def volume_up(self):
-        self._client.send('{0}\r'.format(self._vol_up_command).encode('utf-8'))
+    async def async_volume_up(self):
+        self._ramp.cancel()
+        self._client.send(self._commands[self._vol_up_command])
 
-    def volume_down(self):
-        self._client.send('{0}\r'.format(self._vol_down_command).encode('utf-8'))
+    async def async_volume_down(self):
+        self._ramp.cancel()
+        self._client.send(self._commands[self._vol_down_command])
 
-    def set_volume_level(self, volume):
+    async def async_set_volume_level(self, volume):
+        self._ramp.cancel()
         raw_value = int(volume * (self._max - self._min) + self._min)
         if raw_value > self._max:
             raw_value = self._max
         elif raw_value < self._min:
             raw_value = self._min
-        self._client.send('{0}{1:02d}\r'.format(self._vol_prefix, raw_value).encode('utf-8'))
+        if self._client.send(self._volume_commands[raw_value - self._min]):
+            self._optimistic.expect('_volume', self._normalize_volume(raw_value))
+
+    async def async_fade_volume(self, volume_level, duration):
+        """Fade to a volume level (0..1) over duration seconds. A running fade is retargeted."""
+        target = min(self._max, max(self._min, volume_level * (self._max - self._min) + self._min))
+        current = target if self._volume is None else self._volume * (self._max - self._min) + self._min
+        # The echoes of the fade replace any volume still waiting to be confirmed
+        self._optimistic.cancel('_volume')
+        self._ramp.start(current, target, duration)
 
     @property
     def icon(self):
@@ -271,22 +394,29 @@ class DenonNetworkMediaPlayer(MediaPlayerEntity):
     def source_list(self):
         return self._source_list
 
-    def turn_on(self):
+    async def async_turn_on(self):
         """Turn on the switch"""
-        self._client.send('{0}\r'.format(self._on_command).encode('utf-8'))
+        if self._client.send(self._commands[self._on_command]):
+            self._optimistic.expect('_state', STATE_ON)
     
-    def turn_off(self):
+    async def async_turn_off(self):
         """Turn off the switch"""
-        self._client.send('{0}\r'.format(self._off_command).encode('utf-8'))
+        self._ramp.cancel()
+        if self._client.send(self._commands[self._off_command]):
+            self._optimistic.expect('_state', STATE_OFF)
     
     def set_volume(self, volume):
         self._volume = volume
 
-    def mute_volume(self, mute):
-        if mute == True:
-            self._client.send('{0}\r'.format(self._mute_on_command).encode('utf-8'))
-        else:
-            self._client.send('{0}\r'.format(self._mute_off_command).encode('utf-8'))
+    def _normalize_volume(self, level):
+        return (level - self._min) / (self._max - self._min)
+
+    async def async_mute_volume(self, mute):
+        command = self._mute_on_command if mute == True else self._mute_off_command
+        if self._client.send(self._commands[command]):
+            self._optimistic.expect('_mute', mute == True)
 
-    def select_source(self, source):
-        self._client.send('{0}{1}\r'.format(self._source_prefix, self._sources[source] if source in self._sources else '?').encode('utf-8'))
\ No newline at end of file
+    async def async_select_source(self, source):
+        sent = self._client.send(self._source_commands.get(source, self._source_query))
+        if sent and source in self._source_commands:
+            self._optimistic.expect('_source', source)
\ No newline at end of file
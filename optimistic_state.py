@@ -0,0 +1,75 @@
+"""Optimistic entity attributes confirmed or rolled back by the receiver's echo."""
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_OPTIMISTIC_TIMEOUT = 3
+
+class PendingValue:
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.expected = None
+        self.timer = None
+
+class OptimisticState:
+    """Show the expected result of a command until the receiver echoes it.
+
+    expect() sets an entity attribute and writes the entity state right away.
+    Values the receiver reports for that attribute through apply() are held
+    back until one matches the expected value. If none does within timeout seconds the attribute is rolled back to
+    the last value the receiver reported. A timeout of 0 disables this.
+    """
+
+    def __init__(self, entity, timeout=DEFAULT_OPTIMISTIC_TIMEOUT):
+        self.entity = entity
+        self.timeout = timeout
+        self.rollbacks = 0
+        self._pending = {}
+
+    def expect(self, attribute, value):
+        """Show value in the attribute until the receiver confirms it or the timeout expires."""
+        if not self.timeout or self.entity.hass is None:
+            return
+        pending = self._pending.get(attribute)
+        if pending is None:
+            pending = self._pending[attribute] = PendingValue(getattr(self.entity, attribute))
+        else:
+            pending.timer.cancel()
+        pending.expected = value
+        pending.timer = self.entity.hass.loop.call_later(self.timeout, self._rollback, attribute)
+        setattr(self.entity, attribute, value)
+        self.entity.async_write_ha_state()
+
+    def apply(self, attribute, value):
+        """Apply a value reported by the receiver and return True if the attribute changed."""
+        if not self.received(attribute, value) or getattr(self.entity, attribute) == value:
+            return False
+        setattr(self.entity, attribute, value)
+        return True
+
+    def received(self, attribute, value):
+        """Return True if a value reported by the receiver should be applied now."""
+        pending = self._pending.get(attribute)
+        if pending is None:
+            return True
+        if value != pending.expected:
+            pending.fallback = value
+            return False
+        pending.timer.cancel()
+        del self._pending[attribute]
+        return True
+
+    def cancel(self, attribute=None):
+        """Stop waiting for the echo of one attribute, or of all of them. The shown values are kept."""
+        attributes = list(self._pending) if attribute is None else [attribute]
+        for attribute in attributes:
+            pending = self._pending.pop(attribute, None)
+            if pending is not None:
+                pending.timer.cancel()
+
+    def _rollback(self, attribute):
+        pending = self._pending.pop(attribute)
+        _LOGGER.debug('No echo for %s.%s = %s. Rolling back to %s', self.entity.name, attribute, pending.expected, pending.fallback)
+        self.rollbacks += 1
+        setattr(self.entity, attribute, pending.fallback)
+        self.entity.async_write_ha_state()
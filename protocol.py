@@ -0,0 +1,402 @@
+"""Denon AVR telnet protocol tables.
+
+This module only depends on the standard library so it can be imported by the
+benchmarks and tools in this repository without Home Assistant.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+class PrefixTable:
+    """Longest-prefix lookup table compiled once from (prefix, entry) pairs.
+
+    Prefixes are bucketed by their leading characters so a lookup costs one
+    dict access plus a startswith() per prefix sharing that bucket.
+    """
+
+    def __init__(self, entries):
+        self._entries = dict(entries)
+        self._width = min(len(prefix) for prefix in self._entries)
+        buckets = {}
+        for prefix in sorted(self._entries, key=len, reverse=True):
+            buckets.setdefault(prefix[:self._width], []).append((prefix, len(prefix), self._entries[prefix]))
+        self._buckets = {lead: tuple(bucket) for lead, bucket in buckets.items()}
+
+    def match(self, token):
+        """Return (entry, remainder) for the longest matching prefix or (None, token)."""
+        bucket = self._buckets.get(token[:self._width])
+        if bucket is not None:
+            for prefix, length, entry in bucket:
+                if token.startswith(prefix):
+                    return entry, token[length:]
+        return None, token
+
+    def __contains__(self, prefix):
+        return prefix in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+def _set(client, key, value):
+    client.set_state(key, value)
+
+def _set_stripped(client, key, value):
+    client.set_state(key, value.strip())
+
+def _set_last(client, key, value):
+    client.set_state(key, value[-1:])
+
+def _zone(client, key, value):
+    client.set_zone_state(key, value)
+
+def _channel_setting(client, key, value):
+    client.set_zone_state(key, value)
+
+def _channel_volume(client, key, value):
+    # CVFL 50, CVEND
+    if value != 'END' and ' ' in value:
+        channel, level = value.split()[:2]
+        client.set_state('{0}_ch_vol_{1}'.format(key, channel), level)
+
+def _parameter(client, key, value):
+    # PSCLV 50, PSMULTEQ:AUDYSSEY, SSSPCFL SMA
+    for separator in (' ', ':'):
+        if separator in value:
+            name, _, setting = value.partition(separator)
+            break
+    else:
+        name, setting = value, ''
+    client.set_state('{0}_{1}'.format(key, name.lower()), setting)
+
+# Zone states matched exactly: state -> (decoder, key suffix, value)
+ZONE_STATES = {
+    'ON': (_set, '', 'ON'),
+    'OFF': (_set, '', 'OFF'),
+    'MUON': (_set, '_mute', 'ON'),
+    'MUOFF': (_set, '_mute', 'OFF'),
+}
+
+# Zone attributes: prefix -> (decoder, key suffix)
+ZONE_TABLE = PrefixTable((
+    ('QUICK', (_set_last, '_quick')),
+    ('CS', (_channel_setting, '_ch_set')),
+    ('CV', (_channel_volume, '')),
+    ('HPF', (_set, '_hpf')),
+))
+
+def decode_frame(client, token):
+    """Dispatch a frame to the decoder registered for its longest prefix."""
+    entry, value = FRAME_TABLE.match(token)
+    if entry is not None:
+        decoder, key = entry
+        decoder(client, key, value)
+
+def decode_zone(client, key, state):
+    """Dispatch the zone specific part of a frame (e.g. ON, MUOFF, CVFL 50, CD)."""
+    exact = ZONE_STATES.get(state)
+    if exact is not None:
+        decoder, suffix, value = exact
+        decoder(client, key + suffix, value)
+        return
+    entry, value = ZONE_TABLE.match(state)
+    if entry is not None:
+        decoder, suffix = entry
+        decoder(client, key + suffix, value)
+    # Zone 2/3 volume
+    elif state.isnumeric():
+        client.set_state(key + '_vol', state)
+    # Otherwise this is source
+    else:
+        client.set_state(key + '_source', state)
+
+def encode_command(command):
+    """Return the bytes sent for a command, e.g. 'MVUP' -> b'MVUP\\r'."""
+    return '{0}\r'.format(command).encode('utf-8')
+
+class ZoneSpec:
+    """Command prefixes of one zone.
+
+    Zone 2 and up use their zone prefix for every command (Z2ON, Z2CD, Z250,
+    Z2MUON), so only the prefix needs to be given. The main zone uses a
+    separate prefix per command family.
+    """
+
+    def __init__(self, number, prefix, volume=None, mute=None, source=None, channel_volume=None, volume_max=None, half_steps=False):
+        self.number = number
+        self.key = 'zone{0}'.format(number)
+        self.power = prefix
+        self.volume = volume or prefix
+        self.mute = mute or prefix + 'MU'
+        self.source = source or prefix
+        self.channel_volume = channel_volume or prefix + 'CV'
+        self.volume_max = volume_max
+        # Smallest volume change the zone accepts (MV505 vs Z250)
+        self.volume_step = 0.5 if half_steps else 1
+        self.shared = self.volume == prefix and self.source == prefix
+        # Fixed commands, encoded once
+        self.commands = {
+            'on': encode_command(self.power + 'ON'),
+            'off': encode_command(self.power + 'OFF'),
+            'mute_on': encode_command(self.mute + 'ON'),
+            'mute_off': encode_command(self.mute + 'OFF'),
+            'volume_up': encode_command(self.volume + 'UP'),
+            'volume_down': encode_command(self.volume + 'DOWN'),
+            'source_query': encode_command(self.source + '?'),
+        }
+
+    def families(self):
+        """Return the (prefix, (decoder, state key)) entries decoding this zone."""
+        if self.shared:
+            return [(self.power, (_zone, self.key))]
+        families = [
+            (self.power, (_set, self.key)),
+            (self.volume, (_set, self.key + '_vol')),
+            (self.mute, (_set, self.key + '_mute')),
+            (self.source, (_set, self.key + '_source')),
+            (self.channel_volume, (_channel_volume, self.key)),
+        ]
+        if self.volume_max:
+            families.append((self.volume_max, (_set_stripped, self.key + '_vol_max')))
+        return families
+
+    def queries(self):
+        """Return the (query, state keys) status queries of this zone."""
+        key = self.key
+        if self.shared:
+            return [
+                (self.power + '?', (key, key + '_source', key + '_vol')),
+                (self.mute + '?', (key + '_mute',)),
+                (self.power + 'CS?', (key + '_ch_set*',)),
+                (self.channel_volume + '?', (key + '_ch_vol_*',)),
+                (self.power + 'HPF?', (key + '_hpf',)),
+                (self.power + 'QUICK ?', (key + '_quick',)),
+            ]
+        volume_keys = (key + '_vol', key + '_vol_max') if self.volume_max else (key + '_vol',)
+        return [
+            (self.power + '?', (key,)),
+            (self.volume + '?', volume_keys),
+            (self.mute + '?', (key + '_mute',)),
+            (self.source + '?', (key + '_source',)),
+            (self.channel_volume + '?', (key + '_ch_vol_*',)),
+        ]
+
+    def entity_config(self):
+        """Return the media player command and prefix config of this zone."""
+        return {
+            'on_command': self.power + 'ON',
+            'off_command': self.power + 'OFF',
+            'mute_on_command': self.mute + 'ON',
+            'mute_off_command': self.mute + 'OFF',
+            'vol_up_command': self.volume + 'UP',
+            'vol_down_command': self.volume + 'DOWN',
+            'vol_prefix': self.volume,
+            'source_prefix': self.source,
+        }
+
+# The protocol specification. Supporting another zone or command family is a
+# matter of adding a row here; the tables below are compiled from it.
+
+ZONE_SPECS = (
+    ZoneSpec(1, 'ZM', volume='MV', mute='MU', source='SI', channel_volume='CV', volume_max='MVMAX', half_steps=True),
+    ZoneSpec(2, 'Z2'),
+    ZoneSpec(3, 'Z3'),
+)
+
+# Command families outside the zones: (prefix, decoder, state key)
+FAMILIES = (
+    ('PW', _set, 'power'),
+    ('SV', _set, 'video_select'),
+    ('SLP', _set, 'sleep'),
+    ('MS', _set, 'surround_mode'),
+    ('PS', _parameter, 'ps'),
+    ('SS', _parameter, 'ss'),
+)
+
+# Query forms outside the zones: (query, state keys, poll). Keys ending in * are
+# prefixes and queries answered by frames that are not decoded list no keys.
+# Polled queries are for states the receiver does not reliably push.
+QUERIES = (
+    ('PW?', ('power',), False),
+    ('SR?', (), False),
+    ('SD?', (), False),
+    ('DC?', (), False),
+    ('SV?', ('video_select',), False),
+    ('SLP?', ('sleep',), True),
+    ('MS?', ('surround_mode',), False),
+    ('SSSPC ?', ('ss_spc*',), False),
+    ('PSCLV ?', ('ps_clv',), True),
+    ('PSSWL ?', ('ps_swl',), True),
+    ('SSLEV ?', ('ss_lev*',), True),
+)
+
+ZONES = {zone.number: zone for zone in ZONE_SPECS}
+
+# Top level prefix -> (decoder, state key)
+FRAME_TABLE = PrefixTable(
+    [(prefix, (decoder, key)) for prefix, decoder, key in FAMILIES]
+    + [family for zone in ZONE_SPECS for family in zone.families()]
+)
+
+# Status queries (encoded) and the state keys their answers set
+STATUS_QUERIES = tuple(
+    [(encode_command(query), keys) for query, keys, _ in QUERIES]
+    + [(encode_command(query), keys) for zone in ZONE_SPECS for query, keys in zone.queries()]
+)
+
+POLL_QUERIES = tuple((encode_command(query), keys) for query, keys, poll in QUERIES if poll)
+
+# Volume in receiver steps (0-98, half steps allowed) and in dB
+Volume = namedtuple('Volume', ('level', 'db'))
+
+MASTER_VOLUME_REFERENCE = 80
+CHANNEL_LEVEL_REFERENCE = 50
+
+def parse_volume(raw):
+    """Return the level of a volume such as '50' (50) or '505' (50.5), or None."""
+    raw = raw.strip()
+    if not raw.isdigit() or len(raw) not in (2, 3):
+        return None
+    level = int(raw[:2])
+    if len(raw) == 3:
+        level += int(raw[2]) / 10
+    return level
+
+def format_volume(level):
+    """Return the command form of a volume level, e.g. 50 -> '50', 50.5 -> '505', 5 -> '05'."""
+    whole = int(level)
+    if level - whole >= 0.5:
+        return '{0:02d}5'.format(whole)
+    return '{0:02d}'.format(whole)
+
+def volume_step(prefix):
+    """Return the smallest volume change accepted for a volume prefix. Unknown prefixes use whole steps."""
+    for zone in ZONE_SPECS:
+        if zone.volume == prefix:
+            return zone.volume_step
+    return 1
+
+def _decode_on_off(value):
+    return {'ON': True, 'OFF': False}.get(value)
+
+def _decode_power(value):
+    return {'ON': True, 'STANDBY': False}.get(value)
+
+def _decode_volume(reference):
+    def decode(value):
+        level = parse_volume(value)
+        if level is None:
+            return None
+        return Volume(level, level - reference)
+    return decode
+
+# State key -> decoder of its typed value, and the same for key prefixes
+VALUE_DECODERS = {'power': _decode_power}
+VALUE_PREFIX_DECODERS = []
+for _spec in ZONE_SPECS:
+    VALUE_DECODERS[_spec.key] = _decode_on_off
+    VALUE_DECODERS[_spec.key + '_mute'] = _decode_on_off
+    VALUE_DECODERS[_spec.key + '_vol'] = _decode_volume(MASTER_VOLUME_REFERENCE)
+    VALUE_DECODERS[_spec.key + '_vol_max'] = _decode_volume(MASTER_VOLUME_REFERENCE)
+    VALUE_PREFIX_DECODERS.append((_spec.key + '_ch_vol_', _decode_volume(CHANNEL_LEVEL_REFERENCE)))
+VALUE_PREFIX_TABLE = PrefixTable(VALUE_PREFIX_DECODERS)
+del _spec
+
+def decode_value(key, value):
+    """Return the typed value of a state (bool, Volume) or None if it has no typed form."""
+    decoder = VALUE_DECODERS.get(key)
+    if decoder is None:
+        decoder, _ = VALUE_PREFIX_TABLE.match(key)
+        if decoder is None:
+            return None
+    return decoder(value)
+
+class _Prediction:
+    def __init__(self):
+        self.states = []
+
+    def set_state(self, key, value):
+        self.states.append((key, value))
+
+    def set_zone_state(self, key, state):
+        decode_zone(self, key, state)
+
+def predict_states(command):
+    """Return the (key, value) states the receiver's echo of a command would set.
+
+    Setting commands are echoed verbatim (ZMON, SIGAME, MV50), so decoding
+    the command as a frame predicts its effect. Queries and relative commands
+    (MVUP, Z2DOWN, CVFL UP) predict nothing, and neither does a command whose
+    value does not decode for a state with a typed form.
+    """
+    if command.endswith(('?', 'UP', 'DOWN')):
+        return ()
+    prediction = _Prediction()
+    decode_frame(prediction, command)
+    for key, value in prediction.states:
+        if decode_value(key, value) is None and (key in VALUE_DECODERS or VALUE_PREFIX_TABLE.match(key)[0] is not None):
+            return ()
+    return tuple(prediction.states)
+
+@lru_cache(maxsize=512)
+def coalesce_key(data):
+    """Return the key identifying commands that supersede each other, or None.
+
+    Queries are de-duplicated (MV? and MV?) and settings ending in a value
+    replace each other (MV55 and MV60, CVFL 50 and CVFL 52). The key is the
+    state keys the command sets, so Z250 and Z340 (zone2_vol, zone3_vol) are
+    kept apart. Commands the tables do not decode fall back to the command
+    without its value. Relative commands such as MVUP are never coalesced
+    since every one of them counts.
+    """
+    command = data.rstrip(b'\r')
+    if command.endswith(b'?'):
+        return command
+    stem = command.rstrip(b'0123456789')
+    if not stem or stem == command:
+        return None
+    states = predict_states(command.decode('utf-8', 'replace'))
+    if states:
+        return tuple(key for key, _ in states)
+    return stem
+
+@lru_cache(maxsize=512)
+def affected_states(data):
+    """Return the frozenset of state keys a command can change, or None if unknown.
+
+    Unlike predict_states() this includes relative commands: MVUP and Z2DOWN
+    change zone1_vol and zone2_vol. Queries change nothing.
+    """
+    command = data.rstrip(b'\r').decode('utf-8', 'replace')
+    if command.endswith('?'):
+        return frozenset()
+    for direction in ('UP', 'DOWN'):
+        if command.endswith(direction):
+            # Decode the absolute form of the same setting
+            command = command[:-len(direction)] + '50'
+            break
+    prediction = _Prediction()
+    decode_frame(prediction, command)
+    if not prediction.states:
+        return None
+    return frozenset(key for key, _ in prediction.states)
+
+def query_stem(query):
+    """Return the frame prefix a status query is answered with, e.g. b'Z2QUICK ?\\r' -> 'Z2QUICK'."""
+    return query.decode('ascii').rstrip('\r?').rstrip()
+
+def frames_overlap(stem, token):
+    """Return True if frames starting with stem can match the raw token or prefix (or the reverse)."""
+    return stem.startswith(token) or token.startswith(stem)
+
+def key_matches(pattern, key):
+    """Return True if the state key matches a key pattern (exact or prefix*)."""
+    if pattern.endswith('*'):
+        return key.startswith(pattern[:-1])
+    return key == pattern
+
+def patterns_overlap(first, second):
+    """Return True if some state key could match both key patterns."""
+    if first.endswith('*'):
+        if second.endswith('*'):
+            return first.startswith(second[:-1]) or second.startswith(first[:-1])
+        return key_matches(first, second)
+    return key_matches(second, first)
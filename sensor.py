@@ -1,6 +1,7 @@
 """Support for reading data for a Denon AVR via TCP/IP."""
 import asyncio
 import logging
+from datetime import timedelta
 
 import voluptuous as vol
 
@@ -9,6 +10,7 @@ from homeassistant.const import CONF_NAME, CONF_VALUE_TEMPLATE, EVENT_HOMEASSIST
 from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_track_time_interval
 
 from . import DenonTcpClient
 from . import DOMAIN
@@ -17,15 +19,20 @@ _LOGGER = logging.getLogger(__name__)
 
 CONF_HOST = "host"
 CONF_PORT = "port"
+CONF_DIAGNOSTICS = "diagnostics"
+CONF_DIAGNOSTICS_INTERVAL = "diagnostics_interval"
 
 DEFAULT_NAME = "Denon AVR TCP/IP Sensor"
 DEFAULT_PORT = 23
+DEFAULT_DIAGNOSTICS_INTERVAL = 30
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
         vol.Required(CONF_HOST): cv.string,
         vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
         vol.Optional(CONF_PORT, default=DEFAULT_PORT): cv.positive_int,
+        vol.Optional(CONF_DIAGNOSTICS, default=False): cv.boolean,
+        vol.Optional(CONF_DIAGNOSTICS_INTERVAL, default=DEFAULT_DIAGNOSTICS_INTERVAL): cv.positive_int,
     }
 )
 
@@ -35,13 +42,20 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     host = config.get(CONF_HOST)
     port = config.get(CONF_PORT)
 
-    sensor = DenonNetworkSensor(
+    sensors = [DenonNetworkSensor(
         name,
         host,
         port,
-    )
+    )]
 
-    async_add_entities([sensor], True)
+    if config.get(CONF_DIAGNOSTICS):
+        sensors.append(DenonDiagnosticSensor(
+            '{0} Diagnostics'.format(name),
+            host,
+            config.get(CONF_DIAGNOSTICS_INTERVAL),
+        ))
+
+    async_add_entities(sensors, True)
 
 
 class DenonNetworkSensor(Entity):
@@ -60,6 +74,8 @@ class DenonNetworkSensor(Entity):
         self._port = port
         self._network_loop_task = None
         self._attributes = {}
+        self._update_pending = False
+        self._remove_listeners = []
 
     async def async_added_to_hass(self):
         """Handle when an entity is about to be added to Home Assistant."""
@@ -73,7 +89,17 @@ class DenonNetworkSensor(Entity):
             _LOGGER.error("Client not configured for host %s and integration %s.", self._host, DOMAIN)
             return False
 
-        self.hass.data[DOMAIN][self._host]['client'].add_listener(self.client_data_received)
+        client = self.hass.data[DOMAIN][self._host]['client']
+        self._remove_listeners = [
+            client.add_flush_listener(self.client_data_flushed),
+            client.add_listener(self.client_data_received, replay=True),
+        ]
+        self._attributes['stale'] = len(client.stale_keys) > 0
+
+    async def async_will_remove_from_hass(self):
+        for remove_listener in self._remove_listeners:
+            remove_listener()
+        self._remove_listeners = []
 
     def client_data_received(self, key, value, client):
         _LOGGER.debug("Data updated: %s = %s", key, value)
@@ -81,7 +107,13 @@ class DenonNetworkSensor(Entity):
             self._state = value.lower()
         else:
             self._attributes[key] = value
-        self.async_write_ha_state()
+        self._update_pending = True
+
+    def client_data_flushed(self, client):
+        if self._update_pending:
+            self._update_pending = False
+            self._attributes['stale'] = len(client.stale_keys) > 0
+            self.async_write_ha_state()
 
     @property
     def name(self):
@@ -102,3 +134,77 @@ class DenonNetworkSensor(Entity):
     def state(self):
         """Return the state of the sensor."""
         return self._state
+
+class DenonDiagnosticSensor(Entity):
+    """Client metrics of a Denon AVR connection, refreshed every interval seconds.
+
+    The state is the number of frames received per second since the previous
+    refresh and the attributes hold the counters and histograms of the client.
+    """
+
+    def __init__(
+        self,
+        name,
+        host,
+        interval,
+    ):
+        """Initialize the diagnostic sensor."""
+        self._name = name
+        self._state = None
+        self._host = host
+        self._interval = interval
+        self._attributes = {}
+        self._client = None
+        self._frames_in = None
+        self._remove_timer = None
+
+    async def async_added_to_hass(self):
+        """Handle when an entity is about to be added to Home Assistant."""
+        if self._host not in self.hass.data.get(DOMAIN, {}) or 'client' not in self.hass.data[DOMAIN][self._host]:
+            _LOGGER.error("Client not configured for host %s and integration %s.", self._host, DOMAIN)
+            return False
+
+        self._client = self.hass.data[DOMAIN][self._host]['client']
+        self.refresh(None)
+        self._remove_timer = async_track_time_interval(self.hass, self.refresh_and_write, timedelta(seconds=self._interval))
+
+    async def async_will_remove_from_hass(self):
+        if self._remove_timer is not None:
+            self._remove_timer()
+            self._remove_timer = None
+
+    @callback
+    def refresh_and_write(self, now):
+        self.refresh(now)
+        self.async_write_ha_state()
+
+    def refresh(self, now):
+        self._attributes = self._client.get_metrics()
+        frames_in = self._attributes.get('frames_in', 0)
+        if self._frames_in is not None:
+            self._state = round((frames_in - self._frames_in) / self._interval, 2)
+        self._frames_in = frames_in
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return self._name
+
+    @property
+    def should_poll(self):
+        """No polling needed."""
+        return False
+
+    @property
+    def unit_of_measurement(self):
+        return "frames/s"
+
+    @property
+    def device_state_attributes(self):
+        """Return the client metrics."""
+        return self._attributes
+
+    @property
+    def state(self):
+        """Return the frames received per second."""
+        return self._state
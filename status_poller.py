@@ -0,0 +1,72 @@
+"""Adaptive background polling for states a Denon AVR does not push."""
+import asyncio
+import logging
+
+from .command_scheduler import PRIORITY_STATUS
+from .protocol import POLL_QUERIES
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 60
+DEFAULT_POLL_MIN_INTERVAL = 10
+DEFAULT_POLL_MAX_INTERVAL = 900
+
+class PollEntry:
+    def __init__(self, query, keys, interval):
+        self.query = query
+        self.keys = keys
+        self.interval = interval
+        self.due = None
+        self.changed = False
+
+    def state_changed(self, key, value, client):
+        self.changed = True
+
+class StatusPoller:
+    """Poll each query on its own interval.
+
+    The interval of a query is halved (down to min_interval) when one of its
+    states changed since the previous poll and doubled (up to max_interval)
+    when nothing changed, so busy values stay fresh and quiet ones back off.
+    Polls go through the client's paced send path at status priority.
+    """
+
+    def __init__(
+        self,
+        client,
+        queries=POLL_QUERIES,
+        interval=DEFAULT_POLL_INTERVAL,
+        min_interval=DEFAULT_POLL_MIN_INTERVAL,
+        max_interval=DEFAULT_POLL_MAX_INTERVAL,
+    ):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.polls = 0
+        self.entries = [PollEntry(query, keys, interval) for query, keys in queries]
+        for entry in self.entries:
+            for pattern in entry.keys:
+                if pattern.endswith('*'):
+                    client.add_listener(entry.state_changed, prefix=pattern[:-1])
+                else:
+                    client.add_listener(entry.state_changed, key=pattern)
+
+    async def run(self):
+        loop = self.client.loop
+        for entry in self.entries:
+            entry.due = loop.time() + entry.interval
+        while True:
+            entry = min(self.entries, key=lambda item: item.due)
+            delay = entry.due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if entry.changed:
+                entry.interval = max(self.min_interval, entry.interval / 2)
+            else:
+                entry.interval = min(self.max_interval, entry.interval * 2)
+            entry.changed = False
+            entry.due = loop.time() + entry.interval
+            _LOGGER.debug('Polling %r. Next poll in %.0f s', entry.query, entry.interval)
+            self.polls += 1
+            self.client.send(entry.query, PRIORITY_STATUS)
@@ -13,6 +13,8 @@ from homeassistant.components.switch import SwitchEntity
 
 from . import DOMAIN
 from . import DenonTcpClient
+from .optimistic_state import OptimisticState, DEFAULT_OPTIMISTIC_TIMEOUT
+from .protocol import ZONES, encode_command
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -62,12 +64,10 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         zone = source_config[CONF_ZONE]
         source = source_config[CONF_SOURCE]
         icon = source_config[CONF_ICON] if CONF_ICON in source_config else None
-        prefix = None
-
-        if zone == 1:
-            prefix = "SI"
-        else:
-            prefix = "Z{0}".format(zone)
+        if zone not in ZONES:
+            _LOGGER.error("Zone %s of source switch %s is not supported.", zone, name)
+            continue
+        prefix = ZONES[zone].source
         
         on_command = "{0}{1}".format(prefix, source)
         off_command = "{0}?".format(prefix)
@@ -130,6 +130,12 @@ class DenonNetworkSwitch(SwitchEntity):
         self._network_loop_task = None
         self._attributes = None
         self._client = None
+        self._update_pending = False
+        self._on_bytes = encode_command(on_command)
+        # Source switches turn off by querying the zone's source
+        self._off_bytes = ZONES[zone].commands['source_query'] if source else encode_command(off_command)
+        self._optimistic = OptimisticState(self)
+        self._remove_listeners = []
 
         _LOGGER.debug("Switch configured: on command: %s; off command: %s", self._on_command, self._off_command)
         
@@ -146,32 +152,46 @@ class DenonNetworkSwitch(SwitchEntity):
             return False
 
         self._client = self.hass.data[DOMAIN][self._host]['client']
+        self._optimistic.timeout = self.hass.data[DOMAIN][self._host].get('optimistic_timeout', DEFAULT_OPTIMISTIC_TIMEOUT)
+        self._remove_listeners.append(self._client.add_flush_listener(self.client_data_flushed))
         if self._source:
-            self._client.add_listener(self.client_data_received)
+            self._remove_listeners.append(
+                self._client.add_listener(self.client_data_received, key="zone{0}_source".format(self._zone), replay=True)
+            )
         else:
-            self._client.add_raw_listener(self.client_raw_data_received)
+            self._remove_listeners.append(self._client.add_raw_listener(
+                self.client_raw_data_received,
+                tokens=(self._on_command, self._off_command),
+                replay=True,
+            ))
+
+    async def async_will_remove_from_hass(self):
+        for remove_listener in self._remove_listeners:
+            remove_listener()
+        self._remove_listeners = []
+        self._optimistic.cancel()
 
     def client_data_received(self, key, value, client):
-        if key == "zone{0}_source".format(self._zone):
-            if value == self._source:
-                self._state = STATE_ON
-            else:
-                self._state = STATE_OFF
+        state = STATE_ON if value == self._source else STATE_OFF
+        if self._optimistic.apply('_state', state):
             _LOGGER.debug("State updated (%s): %s", self._name, self._state)
-        self.async_write_ha_state()
+            self._update_pending = True
         
     def client_raw_data_received(self, data, client):
         updated = False
         if data == '':
             return
         if data == self._on_command:
-            self._state = STATE_ON
-            updated = True
+            updated = self._optimistic.apply('_state', STATE_ON)
         elif data == self._off_command:
-            self._state = STATE_OFF
-            updated = True
+            updated = self._optimistic.apply('_state', STATE_OFF)
         if updated:
             _LOGGER.debug("State updated (%s): %s", self._name, self._state)
+            self._update_pending = True
+
+    def client_data_flushed(self, client):
+        if self._update_pending:
+            self._update_pending = False
             self.async_write_ha_state()
 
     @property
@@ -211,10 +231,14 @@ class DenonNetworkSwitch(SwitchEntity):
     def off_command(self):
         return self._off_command
 
-    def turn_on(self):
+    async def async_turn_on(self, **kwargs):
         """Turn on the switch"""
-        self._client.send('{0}\r'.format(self._on_command).encode('utf-8'))
+        if self._client.send(self._on_bytes):
+            self._optimistic.expect('_state', STATE_ON)
     
-    def turn_off(self):
+    async def async_turn_off(self, **kwargs):
         """Turn off the switch"""
-        self._client.send('{0}\r'.format(self._off_command).encode('utf-8'))
+        sent = self._client.send(self._off_bytes)
+        # Turning off a source switch only queries the source, so nothing is expected to change
+        if sent and not self._source:
+            self._optimistic.expect('_state', STATE_OFF)
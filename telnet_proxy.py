@@ -0,0 +1,97 @@
+"""Local telnet server sharing the single connection of a Denon AVR client."""
+import asyncio
+import logging
+
+from .command_scheduler import PRIORITY_USER
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PROXY_HOST = '127.0.0.1'
+MAX_COMMAND_LENGTH = 256
+# Sessions that do not read are closed once this much output is buffered
+MAX_SESSION_BUFFER = 64 * 1024
+
+class ProxySession(asyncio.Protocol):
+    """One downstream connection. Its commands are sent through the client."""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.transport = None
+        self.peer = None
+        # Output starts at a frame boundary so the session never sees half a frame
+        self.synced = False
+        self._buffer = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        self.synced = not self.proxy.client.frames.pending
+        self.proxy.sessions.add(self)
+        _LOGGER.info('Proxy session opened from %s', self.peer)
+
+    def connection_lost(self, exc):
+        self.proxy.sessions.discard(self)
+        _LOGGER.info('Proxy session from %s closed', self.peer)
+
+    def data_received(self, data):
+        self._buffer += data
+        *commands, self._buffer = self._buffer.split(b'\r')
+        if len(self._buffer) > MAX_COMMAND_LENGTH:
+            _LOGGER.warning('Discarding %s bytes without a terminator from %s', len(self._buffer), self.peer)
+            self._buffer = b''
+        for command in commands:
+            command = command.strip(b'\n')
+            if command:
+                self.proxy.commands += 1
+                # Sent as given: the tool expects the receiver's echo even if nothing changes
+                self.proxy.client.send(command + b'\r', PRIORITY_USER, force=True)
+
+    def write(self, data):
+        if not self.synced:
+            _, terminator, data = data.partition(b'\r')
+            if not terminator:
+                return
+            self.synced = True
+            if not data:
+                return
+        if self.transport.get_write_buffer_size() > MAX_SESSION_BUFFER:
+            _LOGGER.warning('Proxy session from %s is not reading. Closing it', self.peer)
+            self.transport.close()
+            return
+        self.transport.write(data)
+
+class TelnetProxy:
+    """Accept downstream telnet connections on a local port.
+
+    Every chunk received from the receiver is written to all sessions and
+    every command from a session is queued like an entity command, so the
+    sessions share the one connection the receiver accepts and the client's
+    command pacing.
+    """
+
+    def __init__(self, client, port, host=DEFAULT_PROXY_HOST):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.commands = 0
+        self._server = None
+
+    async def start(self):
+        try:
+            self._server = await self.client.loop.create_server(lambda: ProxySession(self), self.host, self.port)
+        except OSError as err:
+            _LOGGER.error('Unable to listen on %s:%s for proxy sessions. Error: %s', self.host, self.port, err)
+            return
+        _LOGGER.info('Sharing %s:%s on %s:%s', self.client.host, self.client.port, self.host, self.port)
+
+    def broadcast(self, data):
+        for session in list(self.sessions):
+            session.write(data)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for session in list(self.sessions):
+            session.transport.close()
@@ -0,0 +1,148 @@
+"""Drive DenonTcpClient against the AVR simulator and report latency and convergence.
+
+Requires Home Assistant to be importable since the client is imported from
+this repository. The simulator runs in the same event loop as the client, so
+a stalled loop can make paced commands arrive together and count as too close
+when --min-interval is set. Scenarios:
+
+  startup    time until the client's states match the simulator after connecting
+  round trip latency from sending MVxx until its echo is received
+  burst      time until the states converge after a burst of random commands
+  reconnect  time until reconnected and converged after the simulator drops the connection
+
+Usage: python tools/avr_loadtest.py [--rounds 50] [--burst 40] [--latency 0.01] [--split 0.3] ...
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from avr_simulator import AvrSimulator, format_volume  # noqa: E402
+from component import load_component  # noqa: E402
+
+SOURCES = ('CD', 'GAME', 'DVD', 'BD', 'AUX1', 'NET', 'TUNER')
+
+def random_volume():
+    return format_volume(random.randint(20, 60) + random.choice((0, 0.5)))
+
+def random_command():
+    zone = random.choice(('MV', 'Z2', 'Z3'))
+    return random.choice((
+        lambda: zone + random_volume(),
+        lambda: ('SI' if zone == 'MV' else zone) + random.choice(SOURCES),
+        lambda: ('MU' if zone == 'MV' else zone + 'MU') + random.choice(('ON', 'OFF')),
+        lambda: ('ZM' if zone == 'MV' else zone) + random.choice(('ON', 'OFF')),
+        lambda: 'CV{0} {1}'.format(random.choice(('FL', 'FR', 'C')), random.randint(44, 56)),
+    ))()
+
+def summarize(values):
+    if not values:
+        return 'n/a'
+    values = sorted(values)
+    return 'min {0:.1f} ms, median {1:.1f} ms, p95 {2:.1f} ms, max {3:.1f} ms'.format(
+        values[0] * 1000,
+        values[len(values) // 2] * 1000,
+        values[min(len(values) - 1, int(len(values) * 0.95))] * 1000,
+        values[-1] * 1000,
+    )
+
+async def wait_for_convergence(client, simulator, timeout):
+    """Return the seconds until all queued commands are written and every state matches, or None on timeout."""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    while loop.time() - start < timeout:
+        if client.connection_state == 'connected' and client.queue_depth == 0:
+            expected = simulator.expected_states()
+            if all(client.states.get(key) == value for key, value in expected.items()):
+                return loop.time() - start
+        await asyncio.sleep(0.005)
+    return None
+
+async def measure_round_trips(client, rounds, timeout):
+    loop = asyncio.get_running_loop()
+    latencies = []
+    lost = 0
+    for _ in range(rounds):
+        command = 'MV' + random_volume()
+        started = loop.time()
+        try:
+            await client.query(command, expect_prefix=command, timeout=timeout)
+        except asyncio.TimeoutError:
+            lost += 1
+            continue
+        latencies.append(loop.time() - started)
+    return latencies, lost
+
+async def run(args):
+    client_module = load_component()
+    loop = asyncio.get_running_loop()
+    simulator = AvrSimulator(
+        latency=args.latency,
+        jitter=args.jitter,
+        split=args.split,
+        drop=args.drop,
+        min_interval=args.min_interval,
+    )
+    port = await simulator.start()
+
+    client = client_module.DenonTcpClient(
+        '127.0.0.1',
+        port,
+        command_interval=args.command_interval,
+        cache=False,
+        idle_timeout=0,
+        poll_interval=0,
+        capture=args.capture,
+    )
+    # An unfiltered listener makes every state part of the refresh
+    client.add_listener(lambda key, value, client: None)
+    client.start(loop)
+
+    print('startup:    converged in {0}'.format(format_seconds(await wait_for_convergence(client, simulator, args.timeout))))
+
+    latencies, lost = await measure_round_trips(client, args.rounds, args.timeout)
+    print('round trip: {0} ({1} of {2} lost)'.format(summarize(latencies), lost, args.rounds))
+
+    for _ in range(args.burst):
+        client.send('{0}\r'.format(random_command()).encode('utf-8'))
+    print('burst:      {0} commands converged in {1}'.format(
+        args.burst, format_seconds(await wait_for_convergence(client, simulator, args.timeout))))
+
+    reconnects = client.reconnects
+    simulator.disconnect_all()
+    started = loop.time()
+    while client.reconnects == reconnects and loop.time() - started < args.timeout:
+        await asyncio.sleep(0.005)
+    reconnected = loop.time() - started if client.reconnects != reconnects else None
+    converged = await wait_for_convergence(client, simulator, args.timeout)
+    print('reconnect:  reconnected in {0}, converged {1} later'.format(format_seconds(reconnected), format_seconds(converged)))
+
+    print('client:     {0} commands written, {1} coalesced or dropped'.format(client.scheduler.sent, client.dropped_commands))
+    print('simulator:  {0} commands applied, {1} dropped'.format(simulator.commands, simulator.dropped))
+
+    client.stop()
+    await simulator.stop()
+
+def format_seconds(value):
+    return 'n/a (timed out)' if value is None else '{0:.3f} s'.format(value)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=50, help='round trip measurements')
+    parser.add_argument('--burst', type=int, default=40, help='commands in the burst scenario')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--command-interval', type=float, default=0.05, help='client pacing in seconds')
+    parser.add_argument('--latency', type=float, default=0.01, help='simulator response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--split', type=float, default=0.3, help='probability of splitting a response')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of ignoring a command')
+    parser.add_argument('--min-interval', type=float, default=0.045,
+                        help='simulator drops commands closer than this, slightly below the pacing to absorb timer jitter')
+    parser.add_argument('--capture', default=None, help='record the client traffic to this file for replay_capture.py')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
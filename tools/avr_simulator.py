@@ -0,0 +1,287 @@
+"""Emulate the telnet protocol of a Denon AVR-3312 style receiver.
+
+The simulator answers PW/ZM/MV/MU/SI/MS/CV/Z2/Z3 queries, applies and echoes
+state changes to every connected client and can inject latency, split
+responses into several TCP segments, drop commands, drop commands sent too
+close together and disconnect clients.
+
+Usage: python tools/avr_simulator.py [--port 2323] [--latency 0.02] [--split 0.3] ...
+"""
+import argparse
+import asyncio
+import logging
+import random
+
+_LOGGER = logging.getLogger(__name__)
+
+CHANNELS = ('FL', 'FR', 'C', 'SW', 'SL', 'SR')
+
+def format_volume(value):
+    """50 -> 50, 50.5 -> 505, 5 -> 05."""
+    whole = int(value)
+    if value - whole >= 0.5:
+        return '{0:02d}5'.format(whole)
+    return '{0:02d}'.format(whole)
+
+def parse_volume(raw):
+    if not raw.isdigit() or len(raw) not in (2, 3):
+        return None
+    value = int(raw[:2])
+    if len(raw) == 3:
+        value += 0.5
+    return value
+
+class Zone:
+    def __init__(self, prefix, power='ON', source='CD', volume=40):
+        self.prefix = prefix
+        self.power = power
+        self.source = source
+        self.volume = volume
+        self.mute = 'OFF'
+
+class AvrSimulator:
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.0,
+        split=0.0,
+        drop=0.0,
+        min_interval=0.0,
+        disconnect_after=None,
+        single_connection=True,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.split = split
+        self.drop = drop
+        self.min_interval = min_interval
+        self.disconnect_after = disconnect_after
+        self.single_connection = single_connection
+
+        self.power = 'ON'
+        self.max_volume = 98
+        self.surround_mode = 'STEREO'
+        self.channels = {channel: 50 for channel in CHANNELS}
+        self.zones = {
+            1: Zone('ZM', volume=50),
+            2: Zone('Z2'),
+            3: Zone('Z3', power='OFF', source='AUX1', volume=30),
+        }
+
+        self.commands = 0
+        self.dropped = 0
+        self.clients = set()
+        self.server = None
+        self._handlers = set()
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self._handle_client, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.disconnect_all()
+        self.server.close()
+        await self.server.wait_closed()
+        # Let the client handlers see the closed connections before the loop goes away
+        if self._handlers:
+            await asyncio.wait(list(self._handlers))
+
+    def disconnect_all(self):
+        for writer in list(self.clients):
+            writer.close()
+        self.clients.clear()
+
+    def expected_states(self):
+        """State keys and values DenonTcpClient should converge to."""
+        states = {
+            'power': self.power,
+            'zone1': self.zones[1].power,
+            'zone1_vol': format_volume(self.zones[1].volume),
+            'zone1_mute': self.zones[1].mute,
+            'zone1_source': self.zones[1].source,
+            'surround_mode': self.surround_mode,
+        }
+        for number in (2, 3):
+            zone = self.zones[number]
+            key = 'zone{0}'.format(number)
+            states[key] = zone.power
+            states[key + '_source'] = zone.source
+            states[key + '_vol'] = format_volume(zone.volume)
+            states[key + '_mute'] = zone.mute
+        for channel, level in self.channels.items():
+            states['zone1_ch_vol_' + channel] = format_volume(level)
+        return states
+
+    async def _handle_client(self, reader, writer):
+        if self.single_connection and self.clients:
+            _LOGGER.info('Refusing second connection')
+            writer.close()
+            return
+        self.clients.add(writer)
+        self._handlers.add(asyncio.current_task())
+        buffer = b''
+        last_command = None
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                buffer += data
+                *commands, buffer = buffer.split(b'\r')
+                for command in commands:
+                    now = loop.time()
+                    too_close = last_command is not None and now - last_command < self.min_interval
+                    last_command = now
+                    if too_close or random.random() < self.drop:
+                        self.dropped += 1
+                        continue
+                    self.commands += 1
+                    self._handle_command(command.decode('ascii', 'replace'))
+                    if self.disconnect_after and self.commands % self.disconnect_after == 0:
+                        _LOGGER.info('Injecting disconnect after %d commands', self.commands)
+                        self.disconnect_all()
+                        return
+        finally:
+            self.clients.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def _handle_command(self, command):
+        responses = self._apply(command)
+        if responses:
+            asyncio.ensure_future(self._respond(responses))
+
+    async def _respond(self, frames):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        data = ''.join(frame + '\r' for frame in frames).encode('ascii')
+        for writer in list(self.clients):
+            if writer.is_closing():
+                continue
+            if self.split and random.random() < self.split and len(data) > 1:
+                # Separate writes usually leave as separate TCP segments
+                cut = random.randint(1, len(data) - 1)
+                writer.write(data[:cut])
+                writer.write(data[cut:])
+            else:
+                writer.write(data)
+
+    def _apply(self, command):
+        """Apply a command and return the frames sent back to every client."""
+        if command.startswith('PW'):
+            if command[2:] in ('ON', 'STANDBY'):
+                self.power = command[2:]
+            return ['PW' + self.power]
+        if command.startswith('MVMAX'):
+            return ['MVMAX {0}'.format(format_volume(self.max_volume))]
+        if command.startswith('MV'):
+            return self._volume(self.zones[1], 'MV', command[2:]) + ['MVMAX {0}'.format(format_volume(self.max_volume))]
+        if command.startswith('MU'):
+            return self._mute(self.zones[1], 'MU', command[2:])
+        if command.startswith('ZM'):
+            return self._power(self.zones[1], 'ZM', command[2:])
+        if command.startswith('SI'):
+            if command[2:] != '?':
+                self.zones[1].source = command[2:]
+            return ['SI' + self.zones[1].source]
+        if command.startswith('MS'):
+            if command[2:] != '?':
+                self.surround_mode = command[2:]
+            return ['MS' + self.surround_mode]
+        if command.startswith('CV'):
+            return self._channel_volume(command[2:])
+        for number in (2, 3):
+            prefix = 'Z{0}'.format(number)
+            if command.startswith(prefix):
+                return self._zone(self.zones[number], prefix, command[2:])
+        return []
+
+    def _volume(self, zone, prefix, argument):
+        if argument == 'UP':
+            zone.volume = min(self.max_volume, zone.volume + 0.5)
+        elif argument == 'DOWN':
+            zone.volume = max(0, zone.volume - 0.5)
+        elif argument != '?':
+            value = parse_volume(argument)
+            if value is None:
+                return []
+            zone.volume = min(self.max_volume, value)
+        return [prefix + format_volume(zone.volume)]
+
+    def _mute(self, zone, prefix, argument):
+        if argument in ('ON', 'OFF'):
+            zone.mute = argument
+        return [prefix + zone.mute]
+
+    def _power(self, zone, prefix, argument):
+        if argument in ('ON', 'OFF'):
+            zone.power = argument
+        return [prefix + zone.power]
+
+    def _channel_volume(self, argument):
+        if argument == '?':
+            return ['CV{0} {1}'.format(channel, format_volume(level)) for channel, level in self.channels.items()] + ['CVEND']
+        channel, _, value = argument.partition(' ')
+        if channel not in self.channels:
+            return []
+        if value == 'UP':
+            self.channels[channel] = min(62, self.channels[channel] + 0.5)
+        elif value == 'DOWN':
+            self.channels[channel] = max(38, self.channels[channel] - 0.5)
+        else:
+            level = parse_volume(value)
+            if level is None:
+                return []
+            self.channels[channel] = level
+        return ['CV{0} {1}'.format(channel, format_volume(self.channels[channel]))]
+
+    def _zone(self, zone, prefix, argument):
+        if argument == '?':
+            return [prefix + zone.power, prefix + zone.source, prefix + format_volume(zone.volume)]
+        if argument in ('ON', 'OFF'):
+            return self._power(zone, prefix, argument)
+        if argument.startswith('MU'):
+            return self._mute(zone, prefix + 'MU', argument[2:])
+        if argument in ('UP', 'DOWN') or argument[:1].isdigit():
+            return self._volume(zone, prefix, argument)
+        if argument.endswith('?') or argument.startswith(('CS', 'CV', 'HPF', 'QUICK')):
+            return []
+        zone.source = argument
+        return [prefix + zone.source]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2323)
+    parser.add_argument('--latency', type=float, default=0.0, help='response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra response delay in seconds')
+    parser.add_argument('--split', type=float, default=0.0, help='probability of splitting a response')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of ignoring a command')
+    parser.add_argument('--min-interval', type=float, default=0.0, help='ignore commands closer than this')
+    parser.add_argument('--disconnect-after', type=int, default=None, help='disconnect every N commands')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = AvrSimulator(
+        latency=args.latency,
+        jitter=args.jitter,
+        split=args.split,
+        drop=args.drop,
+        min_interval=args.min_interval,
+        disconnect_after=args.disconnect_after,
+    )
+
+    async def serve():
+        port = await simulator.start(args.host, args.port)
+        _LOGGER.info('Simulating Denon AVR on %s:%s', args.host, port)
+        await simulator.server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Compare the prefix dispatch tables with the legacy parse() if-chain.
+
+Usage: python tools/bench_dispatch.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import decode_frame, decode_zone  # noqa: E402
+
+# Tokens recorded from an AVR-X3300W during request_status() and normal use
+CORPUS = [
+    'PWON', 'MV505', 'MVMAX 98', 'CVFL 50', 'CVFR 50', 'CVC 50', 'CVSW 50', 'CVSL 50', 'CVSR 50', 'CVEND',
+    'MUOFF', 'SIGAME', 'ZMON', 'SRON', 'SDAUTO', 'DCAUTO', 'SVOFF', 'SLPOFF', 'MSDOLBY DIGITAL',
+    'Z2ON', 'Z2CD', 'Z245', 'Z2MUOFF', 'Z2CSST', 'Z2CVFL 50', 'Z2CVFR 50', 'Z2CVEND', 'Z2HPFOFF', 'Z2QUICK1',
+    'Z3OFF', 'Z3AUX1', 'Z330', 'Z3MUON', 'Z3CSMONO', 'Z3CVFL 50', 'Z3CVEND', 'Z3HPFON', 'Z3QUICK2',
+    'SSSPCFL SMA', 'SSSPCC SMA', 'PSCLV 50', 'PSSWL 50', 'SSLEVFL 500', 'PSMULTEQ:AUDYSSEY',
+    'MV51', 'MV515', 'MV52', 'MVUP', 'SISAT/CBL', 'Z246', 'Z247', 'ZMOFF', 'PWSTANDBY',
+]
+
+class Recorder:
+    def __init__(self):
+        self.states = {}
+
+    def set_state(self, key, value):
+        self.states[key] = value
+
+class TableParser(Recorder):
+    def parse(self, data):
+        decode_frame(self, data)
+
+    def set_zone_state(self, key, state):
+        decode_zone(self, key, state)
+
+class ChainParser(Recorder):
+    """The parse()/set_zone_state() chain the dispatch tables replaced."""
+
+    def parse(self, data):
+        if data.startswith('PW'):
+            self.set_state('power', data[2:])
+        elif data.startswith('CV'):
+            self.set_zone_state('zone1', data)
+        elif data.startswith('SI'):
+            self.set_zone_state('zone1', data[2:])
+        elif data.startswith('Z2'):
+            self.set_zone_state('zone2', data[2:])
+        elif data.startswith('Z3'):
+            self.set_zone_state('zone3', data[2:])
+        elif data.startswith('MVMAX'):
+            self.set_state('zone1_vol_max', data[6:])
+        elif data.startswith('MV'):
+            self.set_state('zone1_vol', data[2:])
+        elif data.startswith('MU'):
+            self.set_state('zone1_mute', data[2:])
+        elif data.startswith('ZM'):
+            self.set_state('zone1', data[2:])
+        elif data.startswith('SV'):
+            self.set_state('video_select', data[2:])
+
+    def set_zone_state(self, key, state):
+        if state == 'ON' or state == 'OFF':
+            self.set_state(key, state)
+        elif state == 'MUON' or state == 'MUOFF':
+            self.set_state('{0}_mute'.format(key), state[2:])
+        elif state.startswith('QUICK'):
+            self.set_state('{0}_quick'.format(key), state[-1:])
+        elif state.startswith('CS'):
+            self.set_zone_state('{0}_ch_set'.format(key), state[2:])
+        elif state.startswith('CV'):
+            if state != 'CVEND' and ' ' in state:
+                self.set_state('{0}_ch_vol_{1}'.format(key, state[2:].split()[0]), state[2:].split()[1])
+        elif state.startswith('HPF'):
+            self.set_state('{0}_hpf'.format(key), state[3:])
+        elif state.isnumeric() == True:
+            self.set_state(key + '_vol', state)
+        else:
+            self.set_state(key + '_source', state)
+
+def timer(parser, tokens):
+    def parse_tokens():
+        for token in tokens:
+            parser.parse(token)
+    return timeit.Timer(parse_tokens)
+
+def compare(tokens, iterations):
+    """Interleave runs of both parsers and keep the best time of each."""
+    chain = ChainParser()
+    table = TableParser()
+    timers = (timer(chain, tokens), timer(table, tokens))
+    best = [float('inf'), float('inf')]
+    for _ in range(7):
+        for index, parser_timer in enumerate(timers):
+            best[index] = min(best[index], parser_timer.timeit(iterations))
+    rates = [len(tokens) * iterations / seconds for seconds in best]
+    return chain.states, table.states, rates
+
+def report(label, rates):
+    print('{0:<24} if-chain {1:10,.0f} tokens/s   tables {2:10,.0f} tokens/s ({3:.2f}x)'.format(
+        label, rates[0], rates[1], rates[1] / rates[0]))
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    chain_states, table_states, rates = compare(CORPUS, iterations)
+    report('full corpus', rates)
+
+    # Tokens the chain ignores (MS/PS/SS/SLP) are decoded by the tables, so also
+    # compare on the families both implementations understand.
+    legacy = [token for token in CORPUS if token[:2] not in ('MS', 'PS', 'SS', 'SL')]
+    report('legacy families only', compare(legacy, iterations)[2])
+
+    mismatched = [key for key in chain_states if chain_states[key] != table_states.get(key)]
+    print('keys decoded: {0} (chain) / {1} (tables)'.format(len(chain_states), len(table_states)))
+    if mismatched:
+        print('MISMATCHED: {0}'.format(', '.join(sorted(mismatched))))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
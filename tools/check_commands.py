@@ -0,0 +1,73 @@
+"""Check how outbound commands are coalesced and which states they predict.
+
+Usage: python tools/check_commands.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import affected_states, coalesce_key, predict_states  # noqa: E402
+
+# Pairs of commands where the second one replaces the first when both are queued
+SUPERSEDES = [
+    ('MV50', 'MV505'),
+    ('Z250', 'Z245'),
+    ('Z340', 'Z335'),
+    ('CVFL 50', 'CVFL 52'),
+    ('Z2CVFL 50', 'Z2CVFL 52'),
+    ('PSCLV 50', 'PSCLV 52'),
+    ('MV?', 'MV?'),
+]
+
+# Pairs of commands that must both be written
+DISTINCT = [
+    ('Z250', 'Z340'),
+    ('MV50', 'Z250'),
+    ('Z250', 'Z350'),
+    ('CVFL 50', 'CVFR 50'),
+    ('CVC 50', 'Z2CVC 50'),
+    ('PSCLV 50', 'PSSWL 50'),
+    ('MVUP', 'MVUP'),
+    ('Z2UP', 'Z2UP'),
+    ('MV?', 'Z2?'),
+]
+
+# Commands whose echo cannot be known in advance
+PREDICT_NOTHING = ['MVUP', 'MVDOWN', 'Z2UP', 'Z2DOWN', 'Z3UP', 'CVFL UP', 'Z2CVFL DOWN', 'MV?', 'MVFOO']
+
+# Commands and the state they change, relative ones included
+AFFECTS = [
+    ('MVUP', 'zone1_vol'),
+    ('Z2DOWN', 'zone2_vol'),
+    ('CVFL UP', 'zone1_ch_vol_FL'),
+    ('SICD', 'zone1_source'),
+    ('Z3AUX1', 'zone3_source'),
+]
+
+def key(command):
+    return coalesce_key('{0}\r'.format(command).encode('utf-8'))
+
+def main():
+    failures = []
+    for first, second in SUPERSEDES:
+        if key(first) is None or key(first) != key(second):
+            failures.append('{0} should replace {1}: {2!r} / {3!r}'.format(second, first, key(first), key(second)))
+    for first, second in DISTINCT:
+        if key(first) is not None and key(first) == key(second):
+            failures.append('{0} and {1} share the key {2!r}'.format(first, second, key(first)))
+    for command in PREDICT_NOTHING:
+        if predict_states(command):
+            failures.append('{0} should predict nothing: {1!r}'.format(command, predict_states(command)))
+    for command, state in AFFECTS:
+        states = affected_states('{0}\r'.format(command).encode('utf-8'))
+        if states is None or state not in states:
+            failures.append('{0} should affect {1}: {2!r}'.format(command, state, states))
+    for failure in failures:
+        print('FAILED: ' + failure)
+    checks = len(SUPERSEDES) + len(DISTINCT) + len(PREDICT_NOTHING) + len(AFFECTS)
+    print('{0} of {1} checks passed'.format(checks - len(failures), checks))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
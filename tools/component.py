@@ -0,0 +1,19 @@
+"""Import this repository as the denon_avr_net package from the tools."""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_component(name='denon_avr_net'):
+    """Import the integration (requires Home Assistant) and return its client module."""
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            name,
+            os.path.join(ROOT, '__init__.py'),
+            submodule_search_locations=[ROOT],
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return importlib.import_module(name + '.denon_tcp_client')
@@ -0,0 +1,113 @@
+"""Replay a traffic capture through DenonTcpClient.data_received and report throughput.
+
+Record a capture by adding `capture: /path/to/file` to the host entry of the
+`denon_avr_net` config.
+Inbound chunks are fed to a disconnected client with the same segmentation
+and, by default, the recorded timing. Outbound records are only counted.
+Processing time covers frame reassembly, parse() and the listener fan-out.
+
+Requires Home Assistant to be importable since the client is imported from
+this repository.
+
+Usage: python tools/replay_capture.py capture.log [--speed 1] [--repeat 1] [--fanout 4]
+
+  --speed 1   replay in real time
+  --speed 10  replay ten times faster than recorded
+  --speed 0   replay at maximum speed
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from component import load_component  # noqa: E402
+
+class TokenCounter:
+    def __init__(self):
+        self.tokens = 0
+
+    def __call__(self, token, client):
+        self.tokens += 1
+
+def create_client(client_module, fanout):
+    """A disconnected client with listeners resembling a configured integration."""
+    client = client_module.DenonTcpClient('replay', 0, cache=False, idle_timeout=0, poll_interval=0)
+    client.counter = TokenCounter()
+    client.add_raw_listener(client.counter)
+    seen = {}
+    for _ in range(fanout):
+        # Sensor style broadcast listener, media player style raw listener and a flush listener
+        client.add_listener(lambda key, value, client: seen.__setitem__(key, value))
+        client.add_raw_listener(lambda token, client: token.startswith('Z2'))
+        client.add_flush_listener(lambda client: len(seen))
+    for zone in (1, 2, 3):
+        client.add_listener(lambda key, value, client: None, zone=zone)
+    return client
+
+async def replay(client, capture, records, speed):
+    """Feed the inbound records and return (chunks, tokens, bytes, processing seconds, max lag seconds)."""
+    loop = asyncio.get_running_loop()
+    client.loop = loop
+    chunks = size = 0
+    busy = max_lag = 0.0
+    origin = records[0][0] if records else 0
+    started = loop.time()
+    for timestamp, direction, data in records:
+        if speed:
+            delay = started + (timestamp - origin) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        if direction == capture.DIRECTION_CONNECT:
+            client.frames.clear()
+            continue
+        if direction != capture.DIRECTION_IN:
+            continue
+        before = time.perf_counter()
+        client.data_received(data)
+        busy += time.perf_counter() - before
+        chunks += 1
+        size += len(data)
+    return chunks, client.counter.tokens, size, busy, max_lag
+
+async def run(args):
+    client_module = load_component()
+    capture = importlib.import_module(client_module.__package__ + '.traffic_capture')
+    records = capture.read_capture(args.capture)
+    outbound = sum(1 for record in records if record[1] == capture.DIRECTION_OUT)
+    if records:
+        print('capture:    {0} records over {1:.1f} s, {2} commands written'.format(
+            len(records), records[-1][0] - records[0][0], outbound))
+
+    totals = [0, 0, 0, 0.0]
+    max_lag = 0.0
+    for _ in range(args.repeat):
+        # A fresh client per pass so every state change is seen again
+        client = create_client(client_module, args.fanout)
+        chunks, tokens, size, busy, lag = await replay(client, capture, records, args.speed)
+        totals = [total + value for total, value in zip(totals, (chunks, tokens, size, busy))]
+        max_lag = max(max_lag, lag)
+    chunks, tokens, size, busy = totals
+
+    print('replayed:   {0} chunks, {1} tokens, {2} bytes in {3} pass(es)'.format(chunks, tokens, size, args.repeat))
+    if busy:
+        print('throughput: {0:.0f} tokens/s, {1:.0f} chunks/s, {2:.1f} us per token'.format(
+            tokens / busy, chunks / busy, busy / max(tokens, 1) * 1e6))
+    if args.speed:
+        print('lag:        max {0:.1f} ms behind the recorded timing'.format(max_lag * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', help='capture file written by the client')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor, 0 for maximum speed')
+    parser.add_argument('--repeat', type=int, default=1, help='number of passes over the capture')
+    parser.add_argument('--fanout', type=int, default=4, help='listeners of each kind to attach')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
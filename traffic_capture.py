@@ -0,0 +1,63 @@
+"""Append-only capture of the raw traffic of a Denon AVR connection."""
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+DIRECTION_IN = '<'
+DIRECTION_OUT = '>'
+DIRECTION_CONNECT = '*'
+
+def encode_record(timestamp, direction, data=b''):
+    """Format one record as a line: monotonic seconds, direction and the escaped bytes."""
+    return '{0:.6f} {1} {2}\n'.format(timestamp, direction, data.decode('latin-1').encode('unicode_escape').decode('ascii'))
+
+def decode_record(line):
+    """Parse a record line into (timestamp, direction, data)."""
+    timestamp, direction, data = line.rstrip('\n').split(' ', 2)
+    return float(timestamp), direction, data.encode('ascii').decode('unicode_escape').encode('latin-1')
+
+def read_capture(path):
+    """Return the list of (timestamp, direction, data) records of a capture file."""
+    with open(path, encoding='ascii') as capture:
+        return [decode_record(line) for line in capture if line.strip()]
+
+class TrafficCapture:
+    """Record every received chunk and written command with a monotonic timestamp.
+
+    Inbound chunks are recorded as they arrived, so a replay reproduces the
+    segmentation seen by the frame buffer. Lines are buffered by the file
+    object and flushed when the connection drops or the capture is closed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._file = None
+
+    @property
+    def is_open(self):
+        return self._file is not None
+
+    def open(self):
+        try:
+            self._file = open(self.path, 'a', encoding='ascii')
+        except OSError as err:
+            _LOGGER.error('Unable to open capture file %s. Error: %s', self.path, err)
+            return
+        _LOGGER.info('Capturing traffic to %s', self.path)
+
+    def record(self, direction, data=b''):
+        if self._file is None:
+            return
+        self.records += 1
+        self._file.write(encode_record(time.monotonic(), direction, data))
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,99 @@
+"""Volume fades paced by the command scheduler of a Denon AVR client."""
+import logging
+import math
+
+from .protocol import encode_command, format_volume
+
+_LOGGER = logging.getLogger(__name__)
+
+class VolumeRamp:
+    """Move the volume of a zone to a target level over a duration.
+
+    Levels are sent in steps of the smallest change the zone accepts (half a
+    step for the main zone) when the linear fade reaches them, but never
+    sooner than the client's command interval after the previous one, so a
+    fast fade skips levels rather than queueing them. Starting a fade while
+    one is running continues from the last level sent. A level reported by the
+    receiver that the fade did not send, e.g. from the remote, cancels it.
+    """
+
+    def __init__(self, client, prefix, step=1, name=None):
+        self.client = client
+        self.prefix = prefix
+        self.step = step
+        self.name = name
+        self.level = None
+        self._commands = {}
+        self._sent = set()
+        self._sent_at = None
+        self._timer = None
+        self._start = None
+        self._target = None
+        self._started = None
+        self._duration = 0
+
+    @property
+    def running(self):
+        return self._timer is not None
+
+    def start(self, level, target, duration):
+        """Fade from level to target over duration seconds. A running fade is retargeted from where it is."""
+        if self.running:
+            self._timer.cancel()
+            self._timer = None
+            level = self.level
+        else:
+            level = self._snap(level)
+            self._sent = {level}
+            self._sent_at = None
+            self.level = level
+        self._start = level
+        self._target = self._snap(target)
+        self._started = self.client.loop.time()
+        self._duration = duration
+        _LOGGER.debug('%s: Fading volume from %s to %s over %s s', self.name, self._start, self._target, duration)
+        self._tick()
+
+    def received(self, level):
+        """Cancel the fade if the receiver reports a level the fade did not send."""
+        if self.running and level not in self._sent:
+            _LOGGER.debug('%s: Volume changed to %s outside the fade. Cancelling it', self.name, level)
+            self.cancel()
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _snap(self, level):
+        return round(level / self.step) * self.step
+
+    def _tick(self):
+        self._timer = None
+        now = self.client.loop.time()
+        distance = self._target - self._start
+        elapsed = now - self._started
+        if distance == 0 or elapsed >= self._duration:
+            level = self._target
+        else:
+            # Steps reached so far, rounded towards the start
+            steps = int(abs(distance) * elapsed / self._duration / self.step + 1e-9)
+            level = self._start + math.copysign(steps * self.step, distance)
+        if level != self.level:
+            self._send(level, now)
+        if level == self._target:
+            return
+        next_level = level + math.copysign(self.step, distance)
+        due = self._started + self._duration * (next_level - self._start) / distance
+        if self._sent_at is not None:
+            due = max(due, self._sent_at + self.client.scheduler.interval)
+        self._timer = self.client.loop.call_at(due, self._tick)
+
+    def _send(self, level, now):
+        command = self._commands.get(level)
+        if command is None:
+            command = self._commands[level] = encode_command(self.prefix + format_volume(level))
+        self.level = level
+        self._sent.add(level)
+        self._sent_at = now
+        self.client.send(command)